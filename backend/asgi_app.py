@@ -0,0 +1,146 @@
+"""
+ASGI entry point for the blog post API.
+
+Request bodies are received and responses sent on the event loop, so slow clients and
+long-lived connections wait there instead of holding a thread each. The routes are the
+ones of backend_app, with the same responses and errors. They and the storage I/O they
+do run in a bounded pool of threads.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+import sys
+import tempfile
+try:
+    from backend.backend_app import app as flask_app
+except ModuleNotFoundError:
+    from backend_app import app as flask_app
+
+# Threads running the routes and the storage I/O, requests beyond them wait their turn
+WORKERS = int(os.environ.get('MASTERBLOG_ASGI_WORKERS', 8))
+# Request bodies larger than this are spooled to a temporary file
+MAX_BODY_IN_MEMORY = 1024 * 1024
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='masterblog-asgi')
+
+
+async def app(scope, receive, send):
+    """ The ASGI application """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    """ Answer the startup and shutdown messages of the server """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def read_body(receive):
+    """
+    Receive the whole request body before any thread gets involved.
+    :return: the body as a file object positioned at its start, None if the client
+        disconnected before sending all of it
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=MAX_BODY_IN_MEMORY)
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            # A partial body is never handed to the app, as WSGI servers raise instead
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    body.seek(0)
+    return body
+
+
+def wsgi_environ(scope, body):
+    """
+    Build the WSGI environ of an ASGI http request.
+    The body has been received whole, so its length is known even when it was sent
+    chunked, and the stream ends with it.
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    body.seek(0, os.SEEK_END)
+    environ['CONTENT_LENGTH'] = str(body.tell())
+    body.seek(0)
+    return environ
+
+
+async def handle_http(scope, receive, send):
+    """
+    Run a request through the Flask app in the executor and send the response.
+    A streamed response is read a chunk at a time in the executor, so no thread is held
+    while a chunk is on its way to the client. Every step runs in the same context, which
+    keeps the Flask request context of a streamed response available to all of them.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    body = await read_body(receive)
+    if body is None:
+        return
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                     for name, value in headers]
+
+    def run_app():
+        iterable = flask_app(wsgi_environ(scope, body), start_response)
+        return iterable, iter(iterable)
+
+    try:
+        iterable, chunks = await loop.run_in_executor(executor, context.run, run_app)
+        try:
+            await send({'type': 'http.response.start', **response_start})
+            while True:
+                chunk = await loop.run_in_executor(executor, context.run, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                await loop.run_in_executor(executor, context.run, iterable.close)
+    finally:
+        body.close()
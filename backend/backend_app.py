@@ -1,15 +1,37 @@
 """ Simple blog post API """
 
-import logging
-from pathlib import Path
+import base64
+import binascii
+from collections import Counter
+import functools
+import hashlib
+import itertools
+import json
+import os
 import sys
-from flask import Flask, jsonify, request
+import threading
+import time
+from flask import Flask, g, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 from flask_swagger_ui import get_swaggerui_blueprint
 try:
+    import backend.compression as compression
+    import backend.json_codec as json_codec
+    import backend.log_config as log_config
+    from backend.log_config import payload
+    from backend.post_record import POST_KEYS
+    import backend.metrics as metrics
     import backend.posts as posts
+    from backend.response_cache import ResponseCache
 except ModuleNotFoundError:
+    import compression
+    import json_codec
+    import log_config
+    from log_config import payload
+    from post_record import POST_KEYS
+    import metrics
     import posts
+    from response_cache import ResponseCache
 
 SWAGGER_URL="/api/docs"  # (1) swagger endpoint e.g. HTTP://localhost:5002/api/docs
 API_URL="/static/masterblog.json" # (2) ensure you create this dir and file
@@ -24,10 +46,22 @@ API_INSTRUCTIONS = API_INSTRUCTIONS = {
             "query_params": {
                 "sort": "Field to sort by (optional)",
                 "direction": "Sorting direction (asc or desc, optional)",
+                "date_from": "Only posts dated on or after this yyyy-mm-dd date (optional)",
+                "date_to": "Only posts dated on or before this yyyy-mm-dd date (optional)",
+                "fields": "Comma separated fields to send, e.g. title,author,date (optional, "
+                          "the id is always sent)",
                 "page": "Page number for pagination (optional, default=1)",
-                "limit": "Number of items per page (optional, default=10)"
+                "cursor": "Continue after the page that returned this X-Next-Cursor header "
+                          "(optional, replaces page)",
+                "limit": "Number of items per page (optional, default=10, at most 1000)"
             }
         },
+        {
+            "description": "Get a single blog post.",
+            "method": "GET",
+            "url": "/api/posts/<id>",
+            "note": "<id> should be the blog post ID."
+        },
         {
             "description": "Search for posts based on criteria.",
             "method": "GET",
@@ -37,10 +71,36 @@ API_INSTRUCTIONS = API_INSTRUCTIONS = {
                 "content": "Search by content (optional)",
                 "author": "Search by author (optional)",
                 "date": "Search by date (optional)",
+                "match": "Whether posts must match all or any of the criteria "
+                         "(all or any, optional, default=any)",
+                "rank": "Set to bm25 to order posts by relevance and add their score (optional)",
+                "q": "Search the title, content and author at once (rank=bm25 only, optional)",
+                "date_from": "Only posts dated on or after this yyyy-mm-dd date (optional)",
+                "date_to": "Only posts dated on or before this yyyy-mm-dd date (optional)",
+                "fields": "Comma separated fields to send, e.g. title,author,date (optional, "
+                          "the id and score are always sent)",
                 "page": "Page number for pagination (optional, default=1)",
-                "limit": "Number of items per page (optional, default=10)"
+                "cursor": "Continue after the page that returned this X-Next-Cursor header "
+                          "(optional, replaces page, not with rank)",
+                "limit": "Number of items per page (optional, default=10, at most 1000)"
             }
         },
+        {
+            "description": "Get the response cache counters, the number of responses "
+                           "sent for each status code and the compression counters.",
+            "method": "GET",
+            "url": "/api/stats"
+        },
+        {
+            "description": "Get the request and stage timings in the Prometheus text format.",
+            "method": "GET",
+            "url": "/metrics"
+        },
+        {
+            "description": "Get these instructions.",
+            "method": "GET",
+            "url": "/api/instructions"
+        },
         {
             "description": "Add a new blog post.",
             "method": "POST",
@@ -52,6 +112,19 @@ API_INSTRUCTIONS = API_INSTRUCTIONS = {
                 "content": "Content for the post (mandatory)"
             }
         },
+        {
+            "description": "Add many blog posts at once.",
+            "method": "POST",
+            "url": "/api/posts/bulk",
+            "note": "The body is NDJSON, one post per line in the format of 'Add a new blog "
+                    "post' or of an export, the posts get new ids. Invalid lines are "
+                    "skipped and reported."
+        },
+        {
+            "description": "Export all blog posts as NDJSON, one post per line.",
+            "method": "GET",
+            "url": "/api/posts/export"
+        },
         {
             "description": "Delete a blog post.",
             "method": "DELETE",
@@ -91,21 +164,55 @@ API_INSTRUCTIONS = API_INSTRUCTIONS = {
     }
 }
 
+# The instructions never change, so they are encoded once and pasted into error bodies
+API_INSTRUCTIONS_JSON = json_codec.dumps(API_INSTRUCTIONS, sort_keys=True)
 
-DELETED_POST_MESSAGE = "Post with id {id} has been deleted successfully."
 
-logging.basicConfig(
-    filename= Path(__file__).parent  / 'log/blog_backend.log',
-    filemode='a',
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    encoding='utf-8'
+DELETED_POST_MESSAGE = "Post with id {id} has been deleted successfully."
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MIMETYPE = "application/x-ndjson"
+BULK_BATCH_SIZE = int(os.environ.get('MASTERBLOG_BULK_BATCH_SIZE', 1000))
+# How many rejected lines a bulk import reports back
+BULK_MAX_ERRORS = 100
+# The most posts a listing or search page may hold, larger limits are cut down to it
+MAX_PAGE_LIMIT = int(os.environ.get('MASTERBLOG_MAX_PAGE_LIMIT', 1000))
+
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('MASTERBLOG_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('MASTERBLOG_CACHE_BYTES', 16 * 1024 * 1024))
 )
+# Compressed bodies of static files, such as the Swagger spec, by path, ETag and encoding.
+# The files never change while the app runs, so there is only one generation.
+compressed_files = ResponseCache(max_entries=32, max_bytes=4 * 1024 * 1024)
+# Compressed bodies of error responses by status, error, message and encoding. Most carry
+# the API instructions, which would otherwise be compressed again for every error.
+compressed_errors = ResponseCache(max_entries=64, max_bytes=1024 * 1024)
+STATIC_GENERATION = 'static'
+COMPRESSION_COUNTERS = (
+    ('responses', 'Responses compressed.'),
+    ('input_bytes', 'Bytes of the response bodies before compression.'),
+    ('output_bytes', 'Bytes of the response bodies after compression.'),
+)
+
+# Number of responses sent for each status code
+status_counts = Counter()
+status_counts_lock = threading.Lock()
+
+log_config.configure_logging()
+
+
+class TimedJSONProvider(json_codec.JSONProvider):
+    """ Adds the time jsonify spends encoding a response to the serialize stage """
+
+    def response(self, *args, **kwargs):
+        with metrics.timed('serialize'):
+            return super().response(*args, **kwargs)
 
 
 app = Flask(__name__)
-CORS(app)  # This will enable CORS for all routes
+app.json = TimedJSONProvider(app)
+# The frontend runs on another origin, its scripts may only read the headers listed here
+CORS(app, expose_headers=[NEXT_CURSOR_HEADER])
 swagger_ui_blueprint = get_swaggerui_blueprint(
     SWAGGER_URL,
     API_URL,
@@ -115,16 +222,82 @@ swagger_ui_blueprint = get_swaggerui_blueprint(
 )
 app.register_blueprint(swagger_ui_blueprint, url_prefix=SWAGGER_URL)
 
+def cached_get(view):
+    """
+    Serve GET requests from the response cache and answer them with 304 Not Modified
+    when the client already has the response.
+    The ETag is derived from the posts generation and the normalized request, so it
+    changes with every change to the posts. A matching If-None-Match is answered without
+    running the view. Otherwise the body is taken from the LRU cache when possible and
+    cached after running the view when not. Compressed bodies are cached alongside, see
+    compress_response().
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        generation = posts.generation()
+        digest = hashlib.sha1(f'{generation}|{key}'.encode('utf-8')).hexdigest()
+        # Compressed responses carry the ETag as a weak one
+        if request.if_none_match.contains_weak(digest):
+            response = Response(status=304)
+        else:
+            cached = response_cache.get(key, generation)
+            if cached is not None:
+                body, headers = cached
+                response = Response(body, mimetype='application/json', headers=headers)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                headers = [(NEXT_CURSOR_HEADER, response.headers[NEXT_CURSOR_HEADER])
+                           ] if NEXT_CURSOR_HEADER in response.headers else []
+                if response.is_streamed:
+                    response.response = caching_stream(response.iter_encoded(), key,
+                                                       generation, headers)
+                else:
+                    response_cache.put(key, generation, response.get_data(), headers)
+            g.cached_response = (key, generation)
+        response.set_etag(digest)
+        # Let browsers keep the response but check back with the ETag every time
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+
+def caching_stream(chunks, key, generation, headers):
+    """
+    Pass a streamed body through and cache it once it has been sent in full.
+    Bodies that grow too large for the cache are no longer collected.
+    """
+    body = []
+    size = 0
+    for chunk in chunks:
+        if body is not None:
+            size += len(chunk)
+            if size <= response_cache.max_bytes:
+                body.append(chunk)
+            else:
+                body = None
+        yield chunk
+    if body is not None:
+        response_cache.put(key, generation, b''.join(body), headers)
+
+
 @app.route('/api/posts', methods=['GET'])
+@cached_get
 def get_posts():
     """ Get all posts and send them through the API """
     sort_by = request.args.get('sort', None)
     sort_direction = request.args.get('direction', None)
-    app.logger.info('Request to get posts sorted by %s %s.',
-                    sort_by, sort_direction
+    date_from = request.args.get('date_from', None)
+    date_to = request.args.get('date_to', None)
+    app.logger.info('Request to get posts sorted by %s %s dated from %s to %s.',
+                    sort_by, sort_direction, date_from, date_to
 
     )
-    all_posts = posts.get_all(sort_by, sort_direction)
+    if not valid_date_range(date_from, date_to):
+        return bad_request("Wrong format for the date range.")
+    all_posts = posts.get_all(sort_by, sort_direction, date_from, date_to)
     if all_posts is None and sort_by is None and sort_direction is None:
         app.logger.debug('DEBUG getting posts failed.')
         return internal_server_error("Getting posts failed.")
@@ -135,6 +308,7 @@ def get_posts():
 
 
 @app.route('/api/posts/search', methods=['GET'])
+@cached_get
 def search_posts():
     """ Get all posts that match the search criteria and send them through the API """
     # Handle the GET request
@@ -142,10 +316,175 @@ def search_posts():
     content = request.args.get('content', None)
     author = request.args.get('author', None)
     date = request.args.get('date', None)
-    app.logger.info('Searching for title:%s author:%s date:%s content:%s.',
-        title, author, date, content
+    match = request.args.get('match', 'any')
+    rank = request.args.get('rank', None)
+    date_from = request.args.get('date_from', None)
+    date_to = request.args.get('date_to', None)
+    app.logger.info('Searching for title:%s author:%s date:%s content:%s match:%s rank:%s '
+                    'dated from %s to %s.',
+        title, author, date, content, match, rank, date_from, date_to
     )
-    return paginated_posts(posts.search_posts(title, content, author, date))
+    if match not in ('any', 'all'):
+        return bad_request("Wrong format for matching search criteria.")
+    if not valid_date_range(date_from, date_to):
+        return bad_request("Wrong format for the date range.")
+    if rank is not None and rank != 'bm25':
+        return bad_request("Wrong format for ranking search results.")
+    if rank == 'bm25' and request.args.get('cursor') is not None:
+        return bad_request("Ranked search results can only be paginated by page.")
+    if rank == 'bm25':
+        # Only the posts up to the requested page are ranked out of all the matches
+        page = int(request.args.get('page', 1))
+        limit = min(int(request.args.get('limit', 10)), MAX_PAGE_LIMIT)
+        query = request.args.get('q', None)
+        return paginated_posts(posts.rank_posts(title, content, author, date, query,
+                                                page * limit, date_from, date_to))
+    return paginated_posts(posts.search_posts(title, content, author, date,
+                                              match_all=match == 'all',
+                                              date_from=date_from, date_to=date_to))
+
+
+def valid_date_range(date_from, date_to):
+    """ Check that the dates given for a date range are in the format yyyy-mm-dd """
+    try:
+        posts.date_range(date_from, date_to)
+    except ValueError:
+        return False
+    return True
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """ Send the response cache counters and the status code counts for monitoring """
+    with status_counts_lock:
+        responses = {str(status): count for status, count in sorted(status_counts.items())}
+    return jsonify({"response_cache": response_cache.stats(), "responses": responses,
+                    "compression": compression.stats()})
+
+
+@app.route('/api/instructions', methods=['GET'])
+def get_instructions():
+    """ Send the API instructions, encoded once at startup """
+    return Response(API_INSTRUCTIONS_JSON, mimetype='application/json')
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ Send the request and stage timings and the counters in the Prometheus text format """
+    counters = [(f'masterblog_response_cache_{name}_total', f'Response cache {name}.', value)
+                for name, value in response_cache.stats().items()
+                if name in ('hits', 'misses', 'evictions', 'invalidations')]
+    compression_stats = compression.stats()
+    counters += [(f'masterblog_compression_{name}_total', description,
+                  compression_stats[encoding][name], (('encoding', encoding),))
+                 for name, description in COMPRESSION_COUNTERS
+                 for encoding in compression_stats]
+    return Response(metrics.registry.render(counters),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def start_timing():
+    """ Note when the request came in """
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def count_response(response):
+    """
+    Count the responses by status code, error responses included, and time them.
+    The time is taken when the response is closed, after a streamed body has been sent.
+    """
+    with status_counts_lock:
+        status_counts[response.status_code] += 1
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method = request.method
+        status = response.status_code
+        response.call_on_close(lambda: metrics.observe_request(
+            endpoint, method, status, time.perf_counter() - started))
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compress the body with the encoding the client accepts best, see compression.py.
+    The compressed bodies of the responses in the response cache are kept there, those
+    of static files such as the Swagger spec by their ETag, and those of error responses
+    by their error, so repeated requests are not compressed again. A streamed body is
+    compressed as it goes out, once its first chunks have shown that it is large enough.
+    """
+    if (response.mimetype not in compression.COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.negotiate(request.accept_encodings)
+    if (encoding is None or response.status_code < 200
+            or response.status_code in (204, 206, 304)):
+        return response
+    cached_response = g.get('cached_response')
+    if response.is_streamed and not response.direct_passthrough:
+        chunks = response.iter_encoded()
+        head, size = [], 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= compression.MIN_SIZE:
+                break
+        else:
+            # The whole body has been read and it is too small
+            response.set_data(b''.join(head))
+            return response
+        on_complete = None
+        if cached_response is not None:
+            on_complete = functools.partial(response_cache.put_encoded, *cached_response,
+                                            encoding)
+        response.response = compression.compress_stream(
+            itertools.chain(head, chunks), encoding, on_complete, response_cache.max_bytes)
+        response.headers.pop('Content-Length', None)
+        mark_compressed(response, encoding)
+        return response
+    # Static files are passed through as they are read, their body is read here instead
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < compression.MIN_SIZE:
+        return response
+    etag = response.get_etag()[0]
+    error = g.get('error')
+    if cached_response is not None:
+        cache, key, generation = response_cache, *cached_response
+        compressed = cache.get_encoded(key, generation, encoding)
+    elif etag is not None or error is not None:
+        if etag is not None:
+            cache, key = compressed_files, (request.path, etag, encoding)
+        else:
+            cache, key = compressed_errors, (*error, encoding)
+        generation = STATIC_GENERATION
+        compressed = cache.get(key, generation)
+        compressed = None if compressed is None else compressed[0]
+    else:
+        cache = None
+        compressed = None
+    if compressed is None:
+        compressed = compression.compress(data, encoding)
+        if cache is response_cache:
+            cache.put_encoded(key, generation, encoding, compressed)
+        elif cache is not None:
+            cache.put(key, generation, compressed)
+    response.set_data(compressed)
+    mark_compressed(response, encoding)
+    return response
+
+
+def mark_compressed(response, encoding):
+    """ Set the headers of a response whose body has been compressed """
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        # The compressed body means the same but is not byte for byte the same
+        response.set_etag(etag, weak=True)
 
 
 @app.route('/api/posts', methods=['POST'])
@@ -153,15 +492,70 @@ def add_post():
     """ Add a new blog post """
     app.logger.info('POST request received for /api/posts')
     new_post = request.get_json()
-    app.logger.info('Add post request: %s', new_post)
+    app.logger.info('Add post request: %s', payload(new_post))
     added_post = posts.add_post(new_post)
     if added_post is None:
-        app.logger.debug('New post not accepted: %s.', new_post)  # Log a message
+        app.logger.debug('New post not accepted: %s.', payload(new_post))  # Log a message
         return bad_request("Wrong post format.")
 
     return jsonify(added_post)
 
 
+@app.route('/api/posts/bulk', methods=['POST'])
+def add_posts_in_bulk():
+    """
+    Add the blog posts streamed in as NDJSON.
+    The body is read a line at a time and the valid posts are added in batches of
+    BULK_BATCH_SIZE, each batch with a single write to the storage. Lines of an export
+    are accepted as well, their posts get new ids.
+    """
+    app.logger.info('POST request received for /api/posts/bulk')
+    imported = 0
+    errors = []
+    batch = []
+    for line_number, line in enumerate(request.stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            new_post = json_codec.loads(line)
+        except ValueError:
+            new_post = None
+        if isinstance(new_post, dict) and posts.validate_post_with_id(new_post):
+            del new_post['id']
+        if not posts.validate_post(new_post):
+            if len(errors) < BULK_MAX_ERRORS:
+                errors.append({"line": line_number, "message": "Wrong post format."})
+            continue
+        batch.append(new_post)
+        if len(batch) >= BULK_BATCH_SIZE:
+            imported += len(posts.add_posts(batch))
+            batch = []
+    if batch:
+        imported += len(posts.add_posts(batch))
+    app.logger.info('Bulk import added %s posts and rejected %s lines.', imported, len(errors))
+    return jsonify({"imported": imported, "errors": errors})
+
+
+@app.route('/api/posts/export', methods=['GET'])
+def export_posts():
+    """ Stream every blog post as NDJSON, without holding them all in memory """
+    app.logger.info('GET request received for /api/posts/export')
+    lines = (json_codec.dumps(post) + '\n' for post in posts.export_posts())
+    return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+
+
+@app.route('/api/posts/<int:post_id>', methods=['GET'])
+@cached_get
+def get_post(post_id):
+    """ Get a single blog post """
+    app.logger.info('GET request received for /api/posts/%s', post_id)
+    post = posts.get_post(post_id)
+    if post is None:
+        app.logger.debug('Post %s was not found.', post_id)
+        return not_found_error("No such post was found.")
+    return jsonify(post)
+
+
 @app.route('/api/posts/<int:post_id>', methods=['DELETE'])
 def delete_post(post_id):
     """ Delete a blog post """
@@ -181,28 +575,42 @@ def update(post_id):
     """ Update a blog post """
     app.logger.info('PUT request received for /api/posts/%s', post_id)
     post_to_update = request.get_json()
-    app.logger.debug('Update post: %s %s', post_id, post_to_update)
+    app.logger.debug('Update post: %s %s', post_id, payload(post_to_update))
     updated_post = posts.update_post(post_id, post_to_update)
     if updated_post is None:
         app.logger.debug('Post update not accepted id:%s update:%s.',
-            post_id, post_to_update
+            post_id, payload(post_to_update)
         )
         return not_found_error("Wrong post format or post not found.")
     app.logger.debug('Post update successful: id:%s update:%s.',
-        post_id, post_to_update
+        post_id, payload(post_to_update)
     )
     return jsonify(updated_post)
 
 
+def error_response(error_name, message, status, instructions=True):
+    """
+    Build an error response without encoding the instructions again.
+    The keys come out sorted, the same as jsonify would write them.
+    :param error_name: the value of the error field
+    :param message: the error or the message to explain it
+    :param status: the HTTP status code
+    :param instructions: whether to include the API instructions
+    :return: the error response
+    """
+    body = '{"error":' + json_codec.dumps(error_name)
+    if instructions:
+        body += ',"instructions":' + API_INSTRUCTIONS_JSON
+    body += ',"message":' + json_codec.dumps(str(message)) + '}\n'
+    # Identifies the body, for compress_response to look up its compressed copies
+    g.error = (status, error_name, str(message), instructions)
+    return Response(body, status=status, mimetype='application/json')
+
+
 @app.errorhandler(400)
 def bad_request(error):
     """ What to return when someone is accessing the API in a wrong way. """
-    response = {
-        "error": "Bad Request",
-        "message": str(error),
-        "instructions": API_INSTRUCTIONS
-    }
-    return jsonify(response), 400
+    return error_response("Bad Request", error, 400)
 
 
 @app.errorhandler(404)
@@ -211,44 +619,104 @@ def not_found_error(error):
     What to return when someone is accessing the API with the wrong post Id or
     asking for some other resource which does not exist.
     """
-    return jsonify({
-        "error": "Bad Request",
-        "message": str(error),
-        "instructions": API_INSTRUCTIONS
-    }), 404
+    return error_response("Bad Request", error, 404)
 
 
 @app.errorhandler(405)
 def method_not_allowed_error(error):
     """ What to return when someone is accessing the right API with the wrong method. """
-    return jsonify({
-        "error": "Bad Request",
-        "message": str(error),
-        "instructions": API_INSTRUCTIONS
-    }), 405
+    return error_response("Bad Request", error, 405)
 
 
 @app.errorhandler(500)
 def internal_server_error(error):
     """ Show this when we find something has really gone wrong. """
-    return jsonify({
-        "error": "Internal Server Error",
-        "message": str(error)
-    }), 500
+    return error_response("Internal Server Error", error, 500, instructions=False)
+
+
+def encode_cursor(key):
+    """ Turn the (value, sequence) key of the last post of a page into an opaque cursor """
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor back into a (value, sequence) key.
+    :return: (tuple) the key, or None if the cursor is not valid
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if not isinstance(key, list) or len(key) != 2 or not isinstance(key[1], int):
+        return None
+    return tuple(key)
+
+
+def streamed_json_list(items, fields=None):
+    """
+    Serialize a list to JSON one item at a time, the same way jsonify would.
+    The response starts going out as soon as the first item is encoded.
+    :param fields: the keys of the items to send, None for all of them
+    """
+    yield '['
+    encoding_time = 0.0
+    for index, item in enumerate(items):
+        start = time.perf_counter()
+        if fields is not None:
+            item = {key: item[key] for key in fields if key in item}
+        chunk = (',' if index else '') + app.json.dumps(item, separators=(',', ':'))
+        encoding_time += time.perf_counter() - start
+        yield chunk
+    yield ']\n'
+    metrics.observe_stage('serialize', encoding_time)
 
 
 def paginated_posts(posts_to_paginate):
     """
     Paginates the posts returned by the API.
+    A page is picked either by its number or by the cursor of the page before it. The
+    cursor holds the sort key of the last post of that page, so the next page starts right
+    after it however deep it is and whatever was added or deleted in the meantime.
+    The limit is capped at MAX_PAGE_LIMIT and the page is streamed out post by post.
+    With the fields parameter only those fields of the posts are sent, always with the id
+    and the score of ranked posts, and the content is not even read unless asked for.
     :param posts_to_paginate: posts to paginate
-    :return: paginated posts in json format
+    :return: paginated posts in json format, with the cursor of the next page in the
+        X-Next-Cursor header if there are more posts
     """
     page = int(request.args.get('page', 1))
-    limit = int(request.args.get('limit', 10))
+    limit = min(int(request.args.get('limit', 10)), MAX_PAGE_LIMIT)
+    cursor = request.args.get('cursor', None)
+    fields = request.args.get('fields', None)
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        if not fields or any(field not in POST_KEYS for field in fields):
+            return bad_request("Wrong format for fields.")
+        fields = ['id'] + [field for field in fields if field != 'id'] + ['score']
     start_index = (page - 1) * limit
+    if cursor is not None:
+        key = decode_cursor(cursor)
+        if key is None:
+            return bad_request("Wrong format for the cursor.")
+        try:
+            start_index = posts_to_paginate.index_after(key)
+        except TypeError:
+            # The cursor came from a listing sorted by another field
+            return bad_request("The cursor does not belong to this listing.")
     end_index = start_index + limit
-    paginated_posts_list = posts_to_paginate[start_index:end_index]
-    return jsonify(paginated_posts_list)
+    with metrics.timed('paginate'):
+        if hasattr(posts_to_paginate, 'page'):
+            paginated_posts_list, last_key = posts_to_paginate.page(start_index, limit)
+        else:
+            paginated_posts_list, last_key = posts_to_paginate[start_index:end_index], None
+        if fields is None or 'content' in fields:
+            paginated_posts_list = posts.with_content(paginated_posts_list)
+    response = Response(streamed_json_list(paginated_posts_list, fields),
+                        mimetype='application/json')
+    if last_key is not None and end_index < len(posts_to_paginate):
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last_key)
+    return response
 
 
 if __name__ == '__main__' and "pytest" not in sys.modules:
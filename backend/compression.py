@@ -0,0 +1,138 @@
+"""
+Compression of the API responses.
+
+Bodies are compressed with brotli, when it is installed, or gzip, whichever the client
+rates highest in its Accept-Encoding header. Bodies smaller than MIN_SIZE are sent as
+they are, the few bytes saved would not pay for the time spent compressing them.
+"""
+from collections import Counter
+import os
+import threading
+import time
+import zlib
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import backend.metrics as metrics
+except ModuleNotFoundError:
+    import metrics
+
+MIN_SIZE = int(os.environ.get('MASTERBLOG_COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('MASTERBLOG_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('MASTERBLOG_BROTLI_QUALITY', 5))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain',
+                          'text/html', 'text/css', 'application/javascript'}
+
+# Responses compressed and bytes in and out, by (encoding, counter)
+compression_counts = Counter()
+compression_counts_lock = threading.Lock()
+
+
+def encodings():
+    """ Return the supported encodings, the preferred one first """
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """
+    Pick the encoding to compress a response with.
+    :param accept_encodings: the parsed Accept-Encoding header, as request.accept_encodings
+    :return: (str) the supported encoding the client rates highest, ties going to the
+        preferred one, or None to send the response as it is
+    """
+    best_quality, best_encoding = 0, None
+    for encoding in encodings():
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best_quality, best_encoding = quality, encoding
+    return best_encoding
+
+
+class BrotliCompressor:
+    """ Gives a brotli compressor the interface of a zlib one """
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def compressor(encoding):
+    """ Return a new streaming compressor for the encoding """
+    if encoding == 'br':
+        return BrotliCompressor()
+    # wbits 31 writes a gzip header and trailer, with no timestamp to make it vary
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def record(encoding, size, compressed_size, seconds):
+    """ Count a compressed body and add its compression time to the compress stage """
+    metrics.observe_stage('compress', seconds)
+    with compression_counts_lock:
+        compression_counts[(encoding, 'responses')] += 1
+        compression_counts[(encoding, 'input_bytes')] += size
+        compression_counts[(encoding, 'output_bytes')] += compressed_size
+
+
+def compress(data, encoding):
+    """ Compress a whole body with the encoding """
+    start = time.perf_counter()
+    stream = compressor(encoding)
+    compressed = stream.compress(data) + stream.flush()
+    record(encoding, len(data), len(compressed), time.perf_counter() - start)
+    return compressed
+
+
+def compress_stream(chunks, encoding, on_complete=None, max_collect=0):
+    """
+    Compress a streamed body chunk by chunk.
+    :param chunks: the chunks of the body as bytes
+    :param on_complete: called with the whole compressed body once it has been sent,
+        unless it grew beyond max_collect bytes
+    :param max_collect: the most compressed bytes to collect for on_complete
+    """
+    stream = compressor(encoding)
+    collected = [] if on_complete is not None else None
+    size = compressed_size = 0
+    seconds = 0.0
+    for chunk in chunks:
+        start = time.perf_counter()
+        compressed = stream.compress(chunk)
+        seconds += time.perf_counter() - start
+        size += len(chunk)
+        if compressed:
+            compressed_size += len(compressed)
+            if collected is not None and compressed_size <= max_collect:
+                collected.append(compressed)
+            yield compressed
+    start = time.perf_counter()
+    compressed = stream.flush()
+    seconds += time.perf_counter() - start
+    compressed_size += len(compressed)
+    record(encoding, size, compressed_size, seconds)
+    yield compressed
+    if collected is not None and compressed_size <= max_collect:
+        on_complete(b''.join(collected) + compressed)
+
+
+def stats():
+    """ Return the counters of each encoding with the ratio of output to input bytes """
+    with compression_counts_lock:
+        counts = dict(compression_counts)
+    result = {}
+    for encoding in encodings():
+        input_bytes = counts.get((encoding, 'input_bytes'), 0)
+        output_bytes = counts.get((encoding, 'output_bytes'), 0)
+        result[encoding] = {
+            "responses": counts.get((encoding, 'responses'), 0),
+            "input_bytes": input_bytes,
+            "output_bytes": output_bytes,
+            "ratio": round(output_bytes / input_bytes, 4) if input_bytes else None,
+        }
+    return result
@@ -0,0 +1,82 @@
+"""
+JSON encoding and decoding for the posts files and the API responses.
+
+orjson is used when it is installed, it is several times faster than the standard
+library json module. Without it everything falls back to the json module.
+"""
+from collections.abc import Mapping
+import json
+from flask.json.provider import DefaultJSONProvider
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def to_builtin(obj):
+    """
+    Turn the objects JSON has no type for into ones it has. Mappings that are not dicts,
+    such as post records, become dicts.
+    """
+    if isinstance(obj, Mapping):
+        to_dict = getattr(obj, 'to_dict', None)
+        return to_dict() if to_dict is not None else dict(obj.items())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def loads(data):
+    """ Decode a JSON document given as str, bytes or a memoryview of bytes """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def dumps(obj, sort_keys=False, default=to_builtin):
+    """ Encode an object as a compact JSON str """
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+    return json.dumps(obj, sort_keys=sort_keys, default=default, separators=(',', ':'))
+
+
+def load(json_file):
+    """ Decode a JSON document from a file opened in text mode """
+    return loads(json_file.read())
+
+
+def dump(obj, json_file):
+    """ Encode an object as JSON into a file opened in text mode """
+    json_file.write(dumps(obj))
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider using orjson when it is installed.
+    Output matches the default provider apart from non-ASCII characters, which are
+    written as UTF-8 instead of being escaped.
+    """
+
+    @staticmethod
+    def default(o):
+        """ Encode post records and other mappings as dicts, then what Flask encodes """
+        if isinstance(o, Mapping):
+            return to_builtin(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('cls') is not None:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get('default', self.default),
+                            option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
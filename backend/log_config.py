@@ -0,0 +1,101 @@
+"""
+Logging setup for the blog backend.
+
+Records are put on a queue by the thread that logs them and written to the log file by a
+background thread, so requests never wait on disk for their log lines. A forked process
+does not inherit the threads of its parent, so each forked worker starts a writer
+thread of its own on a queue of its own.
+"""
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+from pathlib import Path
+import queue
+
+LOG_FILE = Path(os.environ.get('MASTERBLOG_LOG_FILE',
+                               Path(__file__).parent / 'log/blog_backend.log'))
+# The level of every logger, e.g. DEBUG, INFO or WARNING
+LOG_LEVEL = os.environ.get('MASTERBLOG_LOG_LEVEL', 'INFO').upper()
+# Levels of single loggers, e.g. "backend.storage=DEBUG,werkzeug=WARNING"
+LOGGER_LEVELS = os.environ.get('MASTERBLOG_LOGGER_LEVELS', '')
+# How much of a logged post or request body is written out
+PAYLOAD_CHARS = int(os.environ.get('MASTERBLOG_LOG_PAYLOAD_CHARS', 200))
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_listener = None
+_queue_handler = None
+
+
+def configure_logging():
+    """
+    Send the log records through a queue to a writer thread appending them to LOG_FILE.
+    Nothing is changed if logging has been configured already, the same as with
+    logging.basicConfig.
+    """
+    global _listener, _queue_handler
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.FileHandler(LOG_FILE, mode='a', encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # The writer thread adds the time and level, the queue only carries the message
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(handlers=[queue_handler], level=LOG_LEVEL)
+    for setting in filter(None, LOGGER_LEVELS.split(',')):
+        name, _, level = setting.partition('=')
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    _queue_handler = queue_handler
+    _listener = QueueListener(log_queue, file_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_start_in_child)
+
+
+def _start_in_child():
+    """
+    Start a writer thread in a forked process. The records the parent had not written
+    yet stay with the parent, the child gets a new queue.
+    """
+    global _listener
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = QueueListener(log_queue, *_listener.handlers)
+    _listener.start()
+
+
+def stop_logging():
+    """ Write out the records still on the queue and stop the writer thread """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class Payload:
+    """
+    A post or request body to pass as a logging argument.
+    It is only turned into text if the record is written out, and then cut short.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        text = str(self.value)
+        if len(text) <= PAYLOAD_CHARS:
+            return text
+        return f'{text[:PAYLOAD_CHARS]}... ({len(text)} characters)'
+
+
+def payload(value):
+    """ Wrap a post or request body for logging, see Payload """
+    return Payload(value)
@@ -0,0 +1,135 @@
+"""
+In-process timing histograms, exposed in the Prometheus text format.
+"""
+from bisect import bisect_left
+import threading
+import time
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_DURATION = 'masterblog_request_duration_seconds'
+STAGE_DURATION = 'masterblog_stage_duration_seconds'
+DESCRIPTIONS = {
+    REQUEST_DURATION: 'Time to answer a request, until its body has been sent.',
+    STAGE_DURATION: 'Time spent in each stage of handling the posts.',
+}
+
+
+class Histogram:
+    """ Counts observations in buckets, the same way a Prometheus histogram does """
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        # The last count is for the observations above the largest bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """ Add one observation """
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """ Keeps a histogram for every metric name and set of labels observed """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, seconds):
+        """
+        Add an observation to a histogram.
+        :param name: the metric name
+        :param labels: (tuple) the (label, value) pairs of the histogram
+        :param seconds: the observed duration
+        """
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = Histogram()
+            histogram.observe(seconds)
+
+    def clear(self):
+        """ Forget every observation """
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self, counters=()):
+        """
+        Return every histogram in the Prometheus text format.
+        :param counters: (name, help, value) of counters kept elsewhere to add, or
+            (name, help, value, labels) with the (label, value) pairs of the counter
+        """
+        with self._lock:
+            histograms = sorted((name, labels, histogram.counts[:], histogram.sum,
+                                 histogram.count)
+                                for (name, labels), histogram in self._histograms.items())
+        lines = []
+        described = set()
+        for name, labels, counts, total, count in histograms:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {DESCRIPTIONS.get(name, name)}')
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} '
+                             f'{cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        for name, description, value, *labels in counters:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{format_labels(labels[0] if labels else ())} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """ Return the labels as {name="value",...}, or nothing without labels """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Timer:
+    """ Adds the time spent inside a with block to a stage histogram """
+    __slots__ = ('labels', 'start')
+
+    def __init__(self, stage):
+        self.labels = (('stage', stage),)
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        registry.observe(STAGE_DURATION, self.labels, time.perf_counter() - self.start)
+
+
+registry = Registry()
+
+
+def timed(stage):
+    """ Return a context manager timing a stage, such as parse, sort or save """
+    return Timer(stage)
+
+
+def observe_stage(stage, seconds):
+    """ Add a duration measured elsewhere to a stage histogram """
+    registry.observe(STAGE_DURATION, (('stage', stage),), seconds)
+
+
+def observe_request(endpoint, method, status, seconds):
+    """ Add the duration of a request to the histogram of its endpoint and status """
+    registry.observe(REQUEST_DURATION, (('endpoint', endpoint), ('method', method),
+                                        ('status', str(status))), seconds)
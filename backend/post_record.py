@@ -0,0 +1,136 @@
+"""
+A compact in-memory record for a blog post.
+"""
+from collections.abc import Mapping
+from datetime import date, datetime
+import sys
+
+POST_KEYS = ('id', 'title', 'author', 'date', 'content')
+
+
+def date_ordinal(date_string):
+    """
+    Return the proleptic Gregorian ordinal of a yyyy-mm-dd date, or None if the string
+    is not one. Dates are read as validate_date reads them, so 2024-3-5 is one too.
+    """
+    try:
+        parsed = date.fromisoformat(date_string)
+    except (TypeError, ValueError):
+        parsed = None
+    # fromisoformat is quicker, but takes other ISO 8601 forms and not unpadded dates
+    if parsed is None or parsed.isoformat() != date_string:
+        try:
+            parsed = datetime.strptime(date_string, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return None
+    return parsed.toordinal()
+
+
+def _is_iso_date(date_string, ordinal):
+    """ Return True if the date string is written the way its ordinal would be written back """
+    return ordinal is not None and date.fromordinal(ordinal).isoformat() == date_string
+
+
+class Post(Mapping):
+    """
+    A blog post held in slots instead of a dict.
+    Authors are interned, so every post of an author shares one string, and dates are
+    kept as integer ordinals, which sort by date and take less memory than strings. The
+    post still reads like the dict it was made from: post['date'] gives the yyyy-mm-dd
+    string, and it compares equal to that dict. It is read-only, changes make a new post.
+    A date that is not yyyy-mm-dd is kept as it was given. A post held without its
+    content, see without_content(), has no 'content' key.
+    """
+    __slots__ = ('id', 'title', 'author', 'date', 'content', 'extra')
+
+    def __init__(self, post_id, title, author, post_date, content, extra=None):
+        self.id = post_id
+        self.title = title
+        self.author = sys.intern(author) if isinstance(author, str) else author
+        ordinal = date_ordinal(post_date)
+        # Dates written any other way, such as 2024-3-5, are kept as given
+        self.date = ordinal if _is_iso_date(post_date, ordinal) else post_date
+        self.content = content
+        # Any other keys the post came with, None when there are none
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, post):
+        """ Make a record of a post dict, or return the post if it is a record already """
+        if isinstance(post, cls):
+            return post
+        extra_keys = post.keys() - POST_KEYS
+        extra = {key: value for key, value in post.items()
+                 if key in extra_keys} if extra_keys else None
+        post_id = post.get('id')
+        return cls(int(post_id) if post_id is not None else None, post.get('title'),
+                   post.get('author'), post.get('date'), post.get('content'), extra)
+
+    def _copy(self, content):
+        """ Return a copy of the post with another content """
+        post = Post.__new__(Post)
+        post.id, post.title, post.author = self.id, self.title, self.author
+        post.date, post.content, post.extra = self.date, content, self.extra
+        return post
+
+    def without_content(self):
+        """ Return the post without its content, to keep in memory when it is stored apart """
+        return self if self.content is None else self._copy(None)
+
+    def with_content(self, content):
+        """ Return the post with its content put back """
+        return self._copy(content)
+
+    def sort_value(self, field):
+        """
+        Return the value of a field to sort by. Dates sort by their ordinal, dates that
+        are not yyyy-mm-dd come first.
+        """
+        if field == 'date':
+            if isinstance(self.date, int):
+                return self.date
+            ordinal = date_ordinal(self.date)
+            return -1 if ordinal is None else ordinal
+        return getattr(self, field)
+
+    def __getitem__(self, key):
+        if key == 'date':
+            return date.fromordinal(self.date).isoformat() if isinstance(self.date, int) \
+                else self.date
+        if key == 'content' and self.content is None:
+            raise KeyError(key)
+        if key in POST_KEYS:
+            return getattr(self, key)
+        if self.extra is not None:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from POST_KEYS if self.content is not None else POST_KEYS[:-1]
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return (len(POST_KEYS) - (self.content is None)
+                + (len(self.extra) if self.extra is not None else 0))
+
+    def __eq__(self, other):
+        if isinstance(other, Post):
+            # Comparing the slots is much quicker than comparing the items one by one
+            return (self.id == other.id and self.title == other.title
+                    and self.author == other.author and self.date == other.date
+                    and self.content == other.content and self.extra == other.extra)
+        return super().__eq__(other)
+
+    def to_dict(self):
+        """ Return the post as a plain dict, for encoding it as JSON """
+        post = {'id': self.id, 'title': self.title, 'author': self.author,
+                'date': self['date']}
+        if self.content is not None:
+            post['content'] = self.content
+        if self.extra is not None:
+            post.update(self.extra)
+        return post
+
+    def __repr__(self):
+        return f'Post({self.to_dict()!r})'
@@ -1,23 +1,45 @@
 """
 A module to handle the blog posts.
 """
+from contextlib import contextmanager
 import logging
 from datetime import datetime
-import json
+import os
 from pathlib import Path
+import threading
+try:
+    from backend.log_config import payload
+    import backend.metrics as metrics
+    from backend.post_record import Post, date_ordinal
+    import backend.storage as storage
+    from backend.search_index import GRAM_FIELDS, SEARCH_FIELDS, RankingIndex, SearchIndex
+    from backend.sorted_index import SORT_FIELDS, SortedIndex, SortedPosts
+except ModuleNotFoundError:
+    from log_config import payload
+    import metrics
+    from post_record import Post, date_ordinal
+    import storage
+    from search_index import GRAM_FIELDS, SEARCH_FIELDS, RankingIndex, SearchIndex
+    from sorted_index import SORT_FIELDS, SortedIndex, SortedPosts
 
-logging.basicConfig(
-    filename= Path(__file__).parent  / 'log/blog_backend.log',
-    filemode='a',
-    level=logging.DEBUG,
-    format='%(asctime)s %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    encoding='utf-8'  # Specify
-)
 logger = logging.getLogger(__name__)
 
 POSTS_FILE = Path(__file__).parent / "data/posts.json"
 
+# 'json' rewrites the posts file on every change, 'journal' appends changes to a journal
+# and 'sqlite' keeps the posts in an SQLite database next to the posts file. 'snapshot'
+# keeps them in a memory-mapped binary snapshot next to it, made from it on first use
+STORAGE_MODE = os.environ.get('MASTERBLOG_STORAGE', 'json')
+COMPACT_THRESHOLD = int(os.environ.get('MASTERBLOG_COMPACT_THRESHOLD', 1000))
+# Whether to keep the posts in memory without their content when the storage can read
+# the content of single posts, as the sqlite storage can
+LAZY_CONTENT = os.environ.get('MASTERBLOG_LAZY_CONTENT', '1') != '0'
+# Whether to index the content by grams instead of words for quicker substring searches,
+# at the cost of several times the memory of the content itself
+CONTENT_GRAMS = os.environ.get('MASTERBLOG_CONTENT_GRAMS', '0') == '1'
+# How many characters of the content posts held without it are sorted by in memory
+CONTENT_SORT_PREFIX = 64
+
 POSTS = [
     {"id": 1, "title": "First post", "author": "Someone", "date": "2020-03-25", "content": "This is the first post."},
     {"id": 2, "title": "Second post", "author": "Somebody", "date": "2020-04-20", "content": "This is the second post."},
@@ -32,23 +54,512 @@ def read_posts(post_file=None):
     """ Read posts from a json file """
     if post_file is None:
         post_file = POSTS_FILE
-    try:
-        with open(post_file, 'r', encoding='utf-8') as json_file:
-            return json.load(json_file)
-    except FileNotFoundError:
-        save_posts([], post_file)
-        return []
-    except Exception as e:
-        logger.error(f"Error: {e}. Unable to read posts from {post_file}. It is not a json file.")
-        return []
+    return storage.read_json(post_file)
 
 
 def save_posts(posts, post_file=None):
-    """ Saves blog posts to a file """
+    """ Saves blog posts to a json file, atomically """
+    if post_file is None:
+        post_file = POSTS_FILE
+    storage.write_json(posts, post_file)
+
+
+class PostStore:
+    """
+    Keeps the blog posts of one posts file in memory.
+    The posts are loaded from the storage once and mutations are written through to it.
+    The storage signature is checked on every access so that changes made by other
+    processes are picked up.
+
+    The posts are kept in a dict by id, so single posts are found in constant time,
+    each as a compact read-only Post record that only turns into a dict when it is
+    encoded as JSON. When the storage can read the content of single posts, the posts
+    are held without their content, which is indexed on load and read back only for
+    the posts that are returned with it. When it can read whole single posts, as the
+    snapshot storage can, single posts are read from it until the posts are loaded.
+    Searches go through inverted indexes and sorted listings through sorted indexes,
+    all of which are kept up to date by the mutations.
+
+    Mutations run inside transaction(), which holds the storage lock, so several
+    processes can safely share the same posts.
+    """
+
+    def __init__(self, post_file, storage_mode=None):
+        self.post_file = Path(post_file)
+        self.storage_mode = STORAGE_MODE if storage_mode is None else storage_mode
+        self.storage = storage.open_storage(self.post_file, self.storage_mode,
+                                            COMPACT_THRESHOLD)
+        # Posts by their int id. Dicts keep insertion order, which is the order of the file.
+        self._posts = {}
+        # Position of each post in the insertion order, to return search results in order
+        self._sequence = {}
+        self._next_sequence = 0
+        self.lazy_content = LAZY_CONTENT and hasattr(self.storage, 'contents')
+        self._ranking_index = RankingIndex()
+        self._search_index = self._new_search_index()
+        # The None index keeps the insertion order
+        self._sorted_indexes = self._new_sorted_indexes()
+        # The content order with ties between cut off contents settled, by generation
+        self._content_order = (None, None)
+        self._max_id = None
+        self._signature = None
+        # Whether the posts in memory have been loaded and kept in step with the storage,
+        # so that the storage can be asked for just the changes since
+        self._synced = False
+        # Bumped by every change to the posts held in memory
+        self._generation = 0
+        self._lock = threading.RLock()
+
+    def _new_search_index(self):
+        """
+        Return an empty search index, leaving out what the storage can search itself.
+        Unless the content is indexed by grams, its words are looked up in the ranking
+        index, which has them already.
+        """
+        fields = [field for field in SEARCH_FIELDS
+                  if field != 'content' or not hasattr(self.storage, 'search_content')]
+        if CONTENT_GRAMS:
+            return SearchIndex(fields, GRAM_FIELDS + ('content',))
+        return SearchIndex(fields, GRAM_FIELDS,
+                           {'content': self._ranking_index.postings('content')})
+
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the locks over a read-modify-write cycle.
+        The posts are brought up to date with the storage first, so changes made by
+        other processes are never overwritten.
+        """
+        with self._lock:
+            while True:
+                # Catch up before taking the storage lock, so that other processes are not
+                # held up while we load, and only the changes made since are left for later
+                self._refresh()
+                with self.storage.lock():
+                    if self._refresh(reload=False):
+                        yield self._posts
+                        return
+
+    def _refresh(self, reload=True):
+        """
+        Bring the posts up to date if the storage has changed since we last read or
+        wrote it. Only the changes made by other processes are applied when the storage
+        can tell them, otherwise every post is loaded again.
+        :param reload: (bool) whether to load every post when the changes are not known
+        :return: (bool) True if the posts are up to date, False if they needed a reload
+            which was not allowed
+        """
+        signature = self.storage.signature()
+        if signature is not None and signature == self._signature:
+            return True
+        with self._lock:
+            changes = self.storage.changes() if self._synced else None
+            if changes is None:
+                if not reload:
+                    return False
+                self._reload()
+            else:
+                self._catch_up(*changes)
+            # Loading may have created the storage, such as a snapshot of the posts file
+            self._signature = signature if signature is not None else self.storage.signature()
+        return True
+
+    def _reload(self):
+        """
+        Load every post. Posts held in full are compared with the loaded ones and only
+        the differences are applied, otherwise the indexes are built again.
+        """
+        logger.debug('Loading posts from %s', self.post_file)
+        with metrics.timed('parse'):
+            posts = {int(post.get('id')): Post.from_dict(post) for post in self.storage.load()}
+        if self._posts and not self.lazy_content:
+            changes = [(post_id, None) for post_id in self._posts if post_id not in posts]
+            changes.extend((post_id, post) for post_id, post in posts.items()
+                           if self._posts.get(post_id) != post)
+            self._catch_up(changes, {})
+        else:
+            self._posts = posts
+            with metrics.timed('index_build'):
+                self._reindex()
+        self._synced = True
+
+    def _catch_up(self, changes, old_contents):
+        """
+        Apply changes read from the storage to the posts and the indexes.
+        :param changes: (list) (post id, post) pairs, the post None for a deleted post
+        :param old_contents: (dict) the contents the posts had before, by post id
+        """
+        with metrics.timed('catch_up'):
+            for post_id, post in changes:
+                if post is None:
+                    self._discard(post_id, old_contents.get(post_id))
+                else:
+                    self._insert(post_id, post, old_contents.get(post_id))
+
+    @contextmanager
+    def _persisting(self):
+        """ Update the signature after a write, or force a reload if the write failed """
+        try:
+            with metrics.timed('save'):
+                yield
+        except Exception:
+            # Memory may have drifted from the storage
+            self._signature = None
+            self._synced = False
+            raise
+        self._signature = self.storage.signature()
+
+    def _reindex(self):
+        """ Rebuild the indexes after the posts have been loaded """
+        self._generation += 1
+        self._max_id = None
+        self._sequence = {post_id: sequence for sequence, post_id in enumerate(self._posts)}
+        self._next_sequence = len(self._posts)
+        self._ranking_index = RankingIndex()
+        self._search_index = self._new_search_index()
+        for post_id, post in self._posts.items():
+            self._search_index.add(post_id, post)
+            self._ranking_index.add(post_id, post)
+        posts = self._posts
+        if self.lazy_content:
+            self._posts = {post_id: post.without_content() for post_id, post in posts.items()}
+        self._sorted_indexes = self._new_sorted_indexes()
+        for sorted_index in self._sorted_indexes.values():
+            sorted_index.build((sequence, post, held_post) for sequence, (post, held_post)
+                               in enumerate(zip(posts.values(), self._posts.values())))
+
+    def _new_sorted_indexes(self):
+        """
+        Return empty sorted indexes, by field. Posts held without their content are
+        sorted by the start of it, see _content_entries().
+        """
+        return {field: SortedIndex(field, CONTENT_SORT_PREFIX
+                                   if field == 'content' and self.lazy_content else None)
+                for field in (None,) + SORT_FIELDS}
+
+    def _insert(self, post_id, post, old_content=None):
+        """
+        Put a new or changed post in memory and in the indexes.
+        :param old_content: the content the post had, for a post held without it whose
+            content in the storage has changed already
+        :return: (Post) the post with its content
+        """
+        self._generation += 1
+        post = Post.from_dict(post)
+        old_post = self._posts.get(post_id)
+        if old_post is not None:
+            # The ranking index needs the words the old post was counted with
+            old_post = self._with_content(old_post, old_content)
+            self._search_index.remove(post_id, old_post)
+            self._ranking_index.remove(post_id, old_post)
+            for sorted_index in self._sorted_indexes.values():
+                sorted_index.remove(self._sequence[post_id], old_post)
+        else:
+            self._sequence[post_id] = self._next_sequence
+            self._next_sequence += 1
+        self._search_index.add(post_id, post)
+        self._ranking_index.add(post_id, post)
+        held_post = post.without_content() if self.lazy_content else post
+        self._posts[post_id] = held_post
+        for sorted_index in self._sorted_indexes.values():
+            sorted_index.add(self._sequence[post_id], post, held_post)
+        if self._max_id is not None and post_id > self._max_id:
+            self._max_id = post_id
+        return post
+
+    def _discard(self, post_id, old_content=None):
+        """
+        Remove a post from memory and from the indexes.
+        :param old_content: the content the post had, see _insert()
+        """
+        post = self._posts.pop(post_id, None)
+        if post is None:
+            return None
+        self._generation += 1
+        post = self._with_content(post, old_content)
+        for sorted_index in self._sorted_indexes.values():
+            sorted_index.remove(self._sequence[post_id], post)
+        del self._sequence[post_id]
+        self._search_index.remove(post_id, post)
+        self._ranking_index.remove(post_id, post)
+        if post_id == self._max_id:
+            self._max_id = None
+        return post
+
+    def posts(self):
+        """ Return a list of the posts held in memory """
+        with self._lock:
+            self._refresh()
+            return self.with_content(self._posts.values())
+
+    def with_content(self, posts_to_fill):
+        """
+        Return the posts with their content, reading it from the storage for the posts
+        held without it.
+        :param posts_to_fill: posts, as returned by sorted_posts or search
+        :return: (list) the posts with their content
+        """
+        posts_to_fill = list(posts_to_fill)
+        missing = [post.id for post in posts_to_fill
+                   if isinstance(post, Post) and post.content is None]
+        if not missing or not self.lazy_content:
+            return posts_to_fill
+        contents = self.storage.contents(missing)
+        return [post.with_content(contents[post.id])
+                if isinstance(post, Post) and post.content is None and post.id in contents
+                else post for post in posts_to_fill]
+
+    def _with_content(self, post, content=None):
+        """ Return one post with its content, or with the content given """
+        if post.content is not None or not self.lazy_content:
+            return post
+        if content is not None:
+            return post.with_content(content)
+        return self.with_content([post])[0]
+
+    def generation(self):
+        """
+        Return a token that changes whenever the posts change.
+        The posts in memory always match the storage signature after a refresh, so the
+        token is the signature itself, which needs no loading of the posts, and every
+        worker process holding the same posts hands out the same token. The generation
+        counter only stands in when there is no storage yet.
+        """
+        with self._lock:
+            signature = self.storage.signature()
+            if signature is None:
+                # Loading may create the storage, such as a snapshot of the posts file
+                self._refresh()
+                signature = self._signature
+            if signature is None:
+                return f'local:{self._generation}'
+            return repr(signature)
+
+    def get(self, post_id):
+        """ Return the post with the id or None """
+        with self._lock:
+            signature = self.storage.signature()
+            if (hasattr(self.storage, 'read_post') and signature is not None
+                    and signature != self._signature):
+                # Read the one post instead of loading all of them
+                post = self.storage.read_post(post_id)
+                return None if post is None else Post.from_dict(post)
+            self._refresh()
+            post = self._posts.get(int(post_id))
+            return None if post is None else self._with_content(post)
+
+    def sorted_posts(self, field=None, reverse=False, date_range=None):
+        """
+        Return a view of the posts sorted by the field, or in insertion order for None.
+        :param date_range: (tuple) the first and last date ordinal of the posts to include,
+            either may be None, or None for all the posts
+        """
+        with self._lock:
+            self._refresh()
+            with metrics.timed('sort'):
+                if field == 'content' and self.lazy_content:
+                    entries = self._content_entries()
+                    if date_range is not None:
+                        ids = self._date_ids(date_range)
+                        entries = [entry for entry in entries if entry[2].id in ids]
+                    return SortedPosts(entries, reverse)
+                if date_range is None:
+                    return SortedPosts(self._sorted_indexes[field].entries, reverse)
+                entries = self._date_entries(date_range)
+                if field == 'date':
+                    return SortedPosts(entries, reverse)
+                # Only the posts in the range are sorted on demand
+                entries = sorted((sequence if field is None else post.sort_value(field),
+                                  sequence, post) for _, sequence, post in entries)
+                return SortedPosts(entries, reverse)
+
+    def _content_entries(self):
+        """
+        Return the entries of the posts held without their content in order of it.
+        The content index sorts them by the start of their content, only posts whose
+        contents start the same are put in order by their whole content, read for them
+        alone. The order is kept until the posts change.
+        """
+        generation, entries = self._content_order
+        if generation == self._generation:
+            return entries
+        sorted_index = self._sorted_indexes['content']
+        entries = sorted_index.entries
+        runs = sorted_index.truncated_runs()
+        if runs:
+            entries = list(entries)
+            contents = self.storage.contents(
+                [post.id for start, stop in runs for _, _, post in entries[start:stop]])
+            # Whole contents still sort between the prefixes around them, so the entries
+            # stay in order for cursors to be bisected
+            for start, stop in runs:
+                entries[start:stop] = sorted((contents.get(post.id, ''), sequence, post)
+                                             for _, sequence, post in entries[start:stop])
+        self._content_order = (self._generation, entries)
+        return entries
+
+    def _date_entries(self, date_range):
+        """ Return the date index entries of the posts dated within the range """
+        first, last = date_range
+        # Dates that are not yyyy-mm-dd sort below every ordinal and are never in a range
+        return self._sorted_indexes['date'].range(1 if first is None else first, last)
+
+    def search(self, criteria, match_all=False, date_range=None):
+        """
+        Find the posts matching the search criteria.
+        :param criteria: (dict) the text to search for by field
+        :param match_all: (bool) True if a post must match every criterion, otherwise
+            matching any of them is enough
+        :param date_range: (tuple) the first and last date ordinal the posts must be dated
+            within, either may be None, or None for any date
+        :return: (SortedPosts) the matching posts in insertion order, each post once
+        """
+        with self._lock:
+            self._refresh()
+            with metrics.timed('index_lookup'):
+                found_ids = None
+                if date_range is not None and not criteria:
+                    found_ids = self._date_ids(date_range)
+                for field, text in criteria.items():
+                    ids = self._search_field(field, text)
+                    if found_ids is None:
+                        found_ids = ids
+                    elif match_all:
+                        found_ids &= ids
+                    else:
+                        found_ids |= ids
+                if date_range is not None and criteria and found_ids:
+                    found_ids &= self._date_ids(date_range)
+                entries = sorted((self._sequence[post_id], self._sequence[post_id],
+                                  self._posts[post_id]) for post_id in found_ids or ())
+                return SortedPosts(entries)
+
+    def _date_ids(self, date_range):
+        """ Return the ids of the posts dated within the range """
+        return {post.id for _, _, post in self._date_entries(date_range)}
+
+    def _search_field(self, field, text):
+        """ Return the ids of the posts whose field contains the text """
+        searches_content = hasattr(self.storage, 'search_content')
+        if field != 'content' or not (searches_content or self.lazy_content):
+            return self._search_index.search(field, text, self._posts)
+        text = text.lower()
+        if searches_content:
+            ids = self.storage.search_content(text)
+        elif not text:
+            return set(self._posts)
+        else:
+            # The candidates are checked against the content read from the storage
+            ids, exact = self._search_index.candidates(field, text)
+            if exact:
+                return ids
+        if self.lazy_content:
+            # None reads every content when the text is too short for the storage index
+            contents = self.storage.contents(ids).items()
+        else:
+            contents = ((post_id, self._posts[post_id]['content'])
+                        for post_id in (self._posts if ids is None else ids))
+        return {post_id for post_id, content in contents
+                if post_id in self._posts and text in content.lower()}
+
+    def rank(self, queries, count, filters=None, date_range=None):
+        """
+        Find the posts scoring best with BM25 for the queries.
+        :param queries: (dict) the query text by field
+        :param count: (int) how many posts to return at most
+        :param filters: (dict) text by field that a post must contain to be ranked
+        :param date_range: (tuple) the first and last date ordinal a post must be dated
+            within to be ranked, either may be None, or None for any date
+        :return: (list) (score, post) tuples, best first
+        """
+        with self._lock:
+            self._refresh()
+            with metrics.timed('index_lookup'):
+                allowed_ids = None if date_range is None else self._date_ids(date_range)
+                for field, text in (filters or {}).items():
+                    ids = self._search_field(field, text)
+                    allowed_ids = ids if allowed_ids is None else allowed_ids & ids
+                best = self._ranking_index.top(queries, count, self._sequence.__getitem__,
+                                               allowed_ids)
+            best_posts = self.with_content(self._posts[post_id] for _, post_id in best)
+            return [(score, post) for (score, _), post in zip(best, best_posts)]
+
+    def next_id(self):
+        """
+        Return the id for a new post, one above the highest id in use.
+        The highest id is kept up to date by the mutations and only looked up again after
+        the post holding it has been deleted or the posts have been reloaded.
+        """
+        with self._lock:
+            if self._max_id is None:
+                self._max_id = max(self._posts, default=0)
+            return self._max_id + 1
+
+    def add(self, new_post):
+        """ Give the post a new id, add it and persist it """
+        with self.transaction():
+            new_post['id'] = self.next_id()
+            self._insert(new_post['id'], new_post)
+            with self._persisting():
+                self.storage.put(new_post, self._posts)
+            return new_post
+
+    def add_many(self, new_posts):
+        """ Give each post a new id, add them all and persist them with one write """
+        with self.transaction():
+            for new_post in new_posts:
+                new_post['id'] = self.next_id()
+                self._insert(new_post['id'], new_post)
+            with self._persisting():
+                self.storage.put_many(new_posts, self._posts)
+            return new_posts
+
+    def update(self, post_id, changes):
+        """ Apply the changes to the post and persist it """
+        with self.transaction() as all_posts:
+            post = all_posts.get(int(post_id))
+            if post is None:
+                return None
+            post = self._insert(int(post_id), {**self._with_content(post), **changes})
+            with self._persisting():
+                self.storage.put(post, self._posts)
+            return post
+
+    def delete(self, post_id):
+        """ Remove the post and persist its removal """
+        with self.transaction():
+            post = self._discard(int(post_id))
+            if post is None:
+                return None
+            with self._persisting():
+                self.storage.delete(post_id, self._posts)
+            return post
+
+    def compact(self):
+        """ Fold the journal into a new snapshot if the storage keeps a journal """
+        if hasattr(self.storage, 'compact'):
+            self.storage.compact()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(post_file=None):
+    """ Return the in-memory store for the posts file, creating it on first use """
     if post_file is None:
         post_file = POSTS_FILE
-    with open(post_file, 'w', encoding='utf-8') as json_file:
-        json.dump(posts, json_file)
+    key = Path(post_file).resolve()
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = PostStore(post_file)
+        return store
+
+
+def generation():
+    """ Return a token that changes whenever the blog posts change """
+    return get_store().generation()
 
 
 def validate_date(date_string):
@@ -62,7 +573,7 @@ def validate_date(date_string):
 
 def validate_post(post):
     """ Validate the blog post format """
-    logger.debug('Validating post: %s', post)  # Log a message
+    logger.debug('Validating post: %s', payload(post))
     if not isinstance(post, dict):
         return False
     for field in ['title', 'author', 'date', 'content']:
@@ -74,7 +585,7 @@ def validate_post(post):
         return False
     if len(post.keys()) != 4:
         return False
-    logger.info('INFO post validated: %s', post)
+    logger.debug('Post validated: %s', payload(post))
     return True
 
 
@@ -99,54 +610,84 @@ def add_post(new_post):
     #print(f"post: {new_post} validated as {is_valid}")
     if not is_valid:
         return None
-    all_posts = read_posts()
-    if len(all_posts) == 0:
-        new_id = 1
-    else:
-        new_id = max(int(post.get('id')) + 1 for post in all_posts)
-    new_post['id'] = new_id
-    all_posts.append(new_post)
-    save_posts(all_posts)
-    logger.info('INFO new post added: %s', new_post)
+    get_store().add(new_post)
+    logger.info('INFO new post added: %s', payload(new_post))
     return new_post
 
 
-def get_all(sort_by = None, sort_direction = None):
+def add_posts(new_posts):
     """
-    Return all blog posts.
+    Add many blog posts at once, persisting them with a single write
+    :param new_posts: (list) the new blog posts, they must all be valid
+    :return: (list) the new blog posts with their unique ids added, None if any is invalid
+    """
+    if not all(validate_post(new_post) for new_post in new_posts):
+        return None
+    added_posts = get_store().add_many(new_posts)
+    logger.info('INFO %s new posts added', len(added_posts))
+    return added_posts
+
+
+def export_posts(chunk_size=1000):
+    """
+    Yield every blog post in insertion order.
+    The posts are read a chunk at a time and each chunk continues after the key of the
+    last post of the one before, so posts added or deleted meanwhile do not make the
+    export skip or repeat posts.
+    """
+    start_index = 0
+    while True:
+        chunk, last_key = get_store().sorted_posts().page(start_index, chunk_size)
+        if not chunk:
+            return
+        yield from get_store().with_content(chunk)
+        start_index = get_store().sorted_posts().index_after(last_key)
+
+
+def date_range(date_from=None, date_to=None):
+    """
+    Turn the first and last date of a range into date ordinals. The dates are read the
+    same way as the dates of the posts, see validate_date.
+    :param date_from: (str) the first date in the format yyyy-mm-dd, None for no limit
+    :param date_to: (str) the last date in the format yyyy-mm-dd, None for no limit
+    :return: (tuple) the ordinals, None when neither date is given
+    :raises ValueError: if a date is not in the format yyyy-mm-dd
+    """
+    if date_from is None and date_to is None:
+        return None
+    ordinals = tuple(None if date is None else date_ordinal(date) for date in (date_from, date_to))
+    for date, ordinal in zip((date_from, date_to), ordinals):
+        if date is not None and ordinal is None:
+            raise ValueError(f'{date} is not a date in the format yyyy-mm-dd')
+    return ordinals
+
+
+def get_all(sort_by = None, sort_direction = None, date_from=None, date_to=None):
+    """
+    Return all blog posts, or the ones dated within a range.
     :param sort_by: (str) the blog post sort key
     :param sort_direction: (str) the blog post sort direction asc/desc
+    :param date_from: (str) the first date of the range, yyyy-mm-dd (optional)
+    :param date_to: (str) the last date of the range, yyyy-mm-dd (optional)
+    :return: (SortedPosts) a read-only sequence of the posts in order, None if the
+        arguments are not valid
     """
-    all_posts = read_posts()
+    try:
+        dates = date_range(date_from, date_to)
+    except ValueError:
+        return None
     if sort_by is None and sort_direction is None:
-        return all_posts
-    if  sort_by is not None and sort_by not in ['title', 'content', 'author', 'date']:
+        return get_store().sorted_posts(date_range=dates)
+    if  sort_by is not None and sort_by not in SORT_FIELDS:
         return None
     if sort_direction is not None and (sort_direction not in ['asc', 'desc'] or sort_by is None):
         return None
-    match sort_by:
-        case 'content':
-            sorted_posts = sorted(all_posts, key=lambda post: post['content'])
-        case 'author':
-            sorted_posts = sorted(all_posts, key=lambda post: post['author'])
-        case 'date':
-            sorted_posts = sorted(all_posts, key=lambda post: post['date'])
-        case _:
-            sorted_posts = sorted(all_posts, key = lambda post: post['title'])
-    if sort_direction == 'desc':
-        sorted_posts.reverse()
-    return sorted_posts
+    return get_store().sorted_posts(sort_by, reverse=sort_direction == 'desc', date_range=dates)
 
 
 def delete_post(post_id):
     """ Delete a post """
-    all_posts = read_posts()
-    for post in list(all_posts):
-        if int(post.get('id')) == int(post_id):
-            all_posts.remove(post)
-            save_posts(all_posts)
-            return post
-    return None
+    return get_store().delete(post_id)
 
 
 def update_post(post_id, new_post):
@@ -160,35 +701,54 @@ def update_post(post_id, new_post):
             return None
     if not validate_date(new_post.get('date', "2025-03-22")):
         return None
-    all_posts = read_posts()
-    for post in all_posts:
-        if int(post.get('id')) == int(post_id):
-            post.update(new_post)
-            save_posts(all_posts)
-            return post
-    return None
+    return get_store().update(post_id, new_post)
 
 
 def get_post(post_id):
     """ Find the blog post """
-    all_posts = read_posts()
-    for post in all_posts:
-        if int(post.get('id')) == int(post_id):
-            return post
-    return None
-
-
-def search_posts(title, content, author, date):
-    """ Find the blog posts that match the search criteria """
-    found_posts = []
-    all_posts = read_posts()
-    for post in all_posts:
-        if title is not None and title.lower() in post.get('title', "").lower():
-            found_posts.append(post)
-        if content is not None and content.lower() in post.get('content', "").lower():
-            found_posts.append(post)
-        if author is not None and author.lower() in post.get('author', "").lower():
-            found_posts.append(post)
-        if date is not None and date.lower() in post.get('date', "").lower():
-            found_posts.append(post)
-    return found_posts
+    return get_store().get(post_id)
+
+
+def with_content(posts_to_fill):
+    """
+    Return posts with their content, read from the storage for the posts held without it.
+    :param posts_to_fill: posts, as returned by get_all or search_posts
+    :return: (list) the posts with their content
+    """
+    return get_store().with_content(posts_to_fill)
+
+
+def search_posts(title, content, author, date, match_all=False, date_from=None,
+                 date_to=None):
+    """
+    Find the blog posts that match the search criteria
+    :param match_all: (bool) True if a post must match all the given criteria, otherwise
+        matching any of them is enough
+    :param date_from: (str) the first date the posts may be dated, yyyy-mm-dd (optional)
+    :param date_to: (str) the last date the posts may be dated, yyyy-mm-dd (optional)
+    :return: (SortedPosts) the matching posts in insertion order, each post once
+    :raises ValueError: if date_from or date_to is not in the format yyyy-mm-dd
+    """
+    criteria = {field: text for field, text in
+                (('title', title), ('content', content), ('author', author), ('date', date))
+                if text is not None}
+    return get_store().search(criteria, match_all, date_range(date_from, date_to))
+
+
+def rank_posts(title, content, author, date, query, count, date_from=None, date_to=None):
+    """
+    Find the blog posts that match the search best, ranked with BM25.
+    :param query: (str) text to look for in the title, content and author
+    :param count: (int) how many posts to return at most
+    :param date_from: (str) the first date the posts may be dated, yyyy-mm-dd (optional)
+    :param date_to: (str) the last date the posts may be dated, yyyy-mm-dd (optional)
+    :return: (list) copies of the best posts with their 'score' added, best first
+    :raises ValueError: if date_from or date_to is not in the format yyyy-mm-dd
+    """
+    queries = {}
+    for field, text in (('title', title), ('content', content), ('author', author)):
+        queries[field] = ' '.join(part for part in (text, query) if part is not None)
+    filters = {'date': date} if date is not None else None
+    return [{**post, 'score': round(score, 4)}
+            for score, post in get_store().rank(queries, count, filters,
+                                                date_range(date_from, date_to))]
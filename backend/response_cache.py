@@ -0,0 +1,111 @@
+"""
+A bounded LRU cache for serialized API responses.
+"""
+from collections import OrderedDict
+import threading
+
+
+class ResponseCache:
+    """
+    Keeps the most recently used response bodies up to a number of entries and bytes.
+    Every entry belongs to one posts generation. As soon as a lookup or store is made
+    for a newer generation, that is after any add, update or delete, the whole cache
+    is dropped.
+    Compressed copies of a body are kept in its entry, they count towards its size and
+    go with it.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_generation(self, generation):
+        """ Drop every entry if the posts have changed """
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._size = 0
+            self._generation = generation
+
+    def get(self, key, generation):
+        """
+        Return the cached (body, headers) for the key or None.
+        :param key: the normalized request
+        :param generation: the current posts generation
+        """
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:2]
+
+    def get_encoded(self, key, generation, encoding):
+        """ Return the cached body for the key compressed with the encoding, or None """
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            return None if entry is None else entry[2].get(encoding)
+
+    def put(self, key, generation, body, headers=()):
+        """ Cache a response body and the headers that go with it """
+        if len(body) > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_generation(generation)
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._size -= self._entry_size(old_entry)
+            self._entries[key] = (body, tuple(headers), {})
+            self._size += len(body)
+            self._evict()
+
+    def put_encoded(self, key, generation, encoding, body):
+        """ Keep a compressed copy of a cached body, if the body is still cached """
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            old_body = entry[2].get(encoding)
+            self._size += len(body) - (len(old_body) if old_body is not None else 0)
+            entry[2][encoding] = body
+            self._evict()
+
+    @staticmethod
+    def _entry_size(entry):
+        """ Return the bytes held by an entry, its compressed copies included """
+        return len(entry[0]) + sum(len(body) for body in entry[2].values())
+
+    def _evict(self):
+        """ Drop the least recently used entries until the cache is within its bounds """
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, evicted_entry = self._entries.popitem(last=False)
+            self._size -= self._entry_size(evicted_entry)
+            self.evictions += 1
+
+    def stats(self):
+        """ Return the counters and the current size of the cache """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,222 @@
+"""
+Inverted indexes for searching and ranking the blog posts.
+"""
+from collections import defaultdict
+import heapq
+import math
+import re
+
+SEARCH_FIELDS = ('title', 'content', 'author', 'date')
+# The fields indexed by grams, the other fields are indexed by words. Grams find the
+# candidates of a search more precisely, but take far more memory for long texts.
+GRAM_FIELDS = ('title', 'author', 'date')
+
+# How much a matching term counts in each field when ranking posts
+RANK_FIELD_WEIGHTS = {'title': 3.0, 'author': 2.0, 'content': 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def grams(text):
+    """
+    Return the grams of a lowercased text: every single character and every run of
+    three characters. Any substring of the text is made of grams of the text.
+    """
+    found = set(text)
+    found.update(text[index:index + 3] for index in range(len(text) - 2))
+    return found
+
+
+def tokens(text):
+    """ Return the lowercased words of a text """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    """
+    Maps the grams or the words of each searchable field to the ids of the posts
+    containing them. Searches are case-insensitive substring matches like a plain `in`
+    check, but only the posts sharing every gram of the search text, or having words
+    that the words of the search text can be part of, are looked at.
+    """
+
+    def __init__(self, fields=SEARCH_FIELDS, gram_fields=GRAM_FIELDS, word_postings=None):
+        """
+        :param gram_fields: the fields to index by grams, the others are indexed by words
+        :param word_postings: (dict) the postings of words by field kept by another index,
+            such as RankingIndex.postings(), to look up words in instead of indexing them
+        """
+        self._shared_postings = {field: postings
+                                 for field, postings in (word_postings or {}).items()
+                                 if field in fields and field not in gram_fields}
+        self._postings = {field: defaultdict(set) for field in fields
+                          if field not in self._shared_postings}
+        self._gram_fields = set(gram_fields)
+        self._ids = set()
+
+    def _keys(self, field, value):
+        """ Return the grams or the words a field value is indexed by """
+        text = str(value).lower()
+        return grams(text) if field in self._gram_fields else set(tokens(text))
+
+    def add(self, post_id, post):
+        """ Index the fields of a post """
+        self._ids.add(post_id)
+        for field, postings in self._postings.items():
+            for key in self._keys(field, post.get(field, "")):
+                postings[key].add(post_id)
+
+    def remove(self, post_id, post):
+        """ Drop a post from the index. The post must hold the values it was indexed with. """
+        self._ids.discard(post_id)
+        for field, postings in self._postings.items():
+            for gram in self._keys(field, post.get(field, "")):
+                ids = postings.get(gram)
+                if ids is None:
+                    continue
+                ids.discard(post_id)
+                if not ids:
+                    del postings[gram]
+
+    def search(self, field, text, posts_by_id):
+        """
+        Find the posts whose field contains the text.
+        :param field: (str) the field to search in
+        :param text: (str) the text to search for
+        :param posts_by_id: (dict) the indexed posts by id, to check the candidates
+        :return: (set) the ids of the matching posts
+        """
+        text = text.lower()
+        if not text:
+            return set(posts_by_id)
+        candidates, exact = self.candidates(field, text)
+        if exact:
+            return candidates
+        return {post_id for post_id in candidates
+                if text in str(posts_by_id[post_id].get(field, "")).lower()}
+
+    def candidates(self, field, text):
+        """
+        Find the posts whose field has every gram of the text, or a word for every word
+        of the text.
+        :param field: (str) the field to search in
+        :param text: (str) the text to search for, lowercase and not empty
+        :return: (tuple) the set of candidate ids, and True if they all match for sure
+        """
+        if field not in self._gram_fields:
+            return self._word_candidates(field, text), False
+        postings = self._postings[field]
+        if len(text) >= 3:
+            query_grams = {text[index:index + 3] for index in range(len(text) - 2)}
+        else:
+            query_grams = set(text)
+        id_sets = sorted((postings.get(gram, set()) for gram in query_grams), key=len)
+        candidates = set(id_sets[0]).intersection(*id_sets[1:])
+        # The gram is the whole text, so every candidate is a match
+        return candidates, len(text) in (1, 3)
+
+    def _word_candidates(self, field, text):
+        """
+        Find the posts having a word for every word of the text. A word of the text
+        which the text cuts off at its start or end may be the end or the start of a
+        longer word, the vocabulary is scanned for those.
+        """
+        postings = self._shared_postings.get(field)
+        if postings is None:
+            postings = self._postings[field]
+        id_sets = []
+        for match in TOKEN_PATTERN.finditer(text):
+            word = match.group()
+            open_start, open_end = match.start() == 0, match.end() == len(text)
+            if not open_start and not open_end:
+                id_sets.append(postings.get(word, ()))
+                continue
+            if open_start and open_end:
+                words = [key for key in postings if word in key]
+            elif open_start:
+                words = [key for key in postings if key.endswith(word)]
+            else:
+                words = [key for key in postings if key.startswith(word)]
+            id_sets.append(set().union(*(postings[key] for key in words)))
+        if not id_sets:
+            return set(self._ids)
+        id_sets.sort(key=len)
+        return set(id_sets[0]).intersection(*id_sets[1:])
+
+
+class RankingIndex:
+    """
+    Keeps the term frequencies and field lengths needed to rank posts with BM25.
+    Each field is scored on its own and the field scores are added up with the field
+    weights.
+    """
+
+    def __init__(self, field_weights=None):
+        self.field_weights = dict(RANK_FIELD_WEIGHTS if field_weights is None else field_weights)
+        self._postings = {field: defaultdict(dict) for field in self.field_weights}
+        self._lengths = {field: {} for field in self.field_weights}
+        self._total_lengths = dict.fromkeys(self.field_weights, 0)
+
+    def add(self, post_id, post):
+        """ Count the terms of a post """
+        for field, postings in self._postings.items():
+            words = tokens(str(post.get(field, "")))
+            self._lengths[field][post_id] = len(words)
+            self._total_lengths[field] += len(words)
+            for word in words:
+                frequencies = postings[word]
+                frequencies[post_id] = frequencies.get(post_id, 0) + 1
+
+    def postings(self, field):
+        """ Return the frequencies of each word in a field by post id, by word """
+        return self._postings[field]
+
+    def remove(self, post_id, post):
+        """ Drop a post. The post must hold the values it was counted with. """
+        for field, postings in self._postings.items():
+            self._total_lengths[field] -= self._lengths[field].pop(post_id, 0)
+            for word in set(tokens(str(post.get(field, "")))):
+                frequencies = postings.get(word)
+                if frequencies is None:
+                    continue
+                frequencies.pop(post_id, None)
+                if not frequencies:
+                    del postings[word]
+
+    def _field_scores(self, field, words, scores, allowed_ids):
+        """ Add the weighted BM25 scores of the words in one field to the scores """
+        lengths = self._lengths[field]
+        if not lengths:
+            return
+        weight = self.field_weights[field]
+        average_length = self._total_lengths[field] / len(lengths) or 1
+        for word in words:
+            frequencies = self._postings[field].get(word)
+            if not frequencies:
+                continue
+            idf = math.log(1 + (len(lengths) - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+            for post_id, frequency in frequencies.items():
+                if allowed_ids is not None and post_id not in allowed_ids:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[post_id] / average_length)
+                scores[post_id] = (scores.get(post_id, 0.0)
+                                   + weight * idf * frequency * (BM25_K1 + 1) / (frequency + norm))
+
+    def top(self, queries, count, order, allowed_ids=None):
+        """
+        Find the best scoring posts.
+        :param queries: (dict) the query text by field
+        :param count: (int) how many posts to return at most
+        :param order: (callable) the insertion order of a post id, breaks ties
+        :param allowed_ids: (set) only score these posts, None for all posts
+        :return: (list) (score, post id) tuples, best first
+        """
+        scores = {}
+        for field, text in queries.items():
+            if field in self._postings:
+                self._field_scores(field, tokens(text), scores, allowed_ids)
+        best = heapq.nlargest(count, scores.items(),
+                              key=lambda item: (item[1], -order(item[0])))
+        return [(score, post_id) for post_id, score in best]
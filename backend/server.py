@@ -0,0 +1,169 @@
+"""
+Production server for the blog post API, with several worker processes.
+
+gunicorn is used when it is installed, with pre-forked gthread workers. Without it the
+workers are forked here and share one listening socket, each serving requests on a pool
+of threads with the Werkzeug server. SIGTERM stops the workers after the requests they
+are serving.
+
+The workers do not share memory. Each one holds its own copy of the posts and checks
+the storage signature on every request, so a change written by one worker is picked up
+by the others before they answer their next request.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import signal
+import socket
+import threading
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+try:
+    import gunicorn.app.base
+except ImportError:
+    gunicorn = None
+try:
+    import backend.log_config as log_config
+except ModuleNotFoundError:
+    import log_config
+
+WORKERS = int(os.environ.get('MASTERBLOG_WORKERS', os.cpu_count() or 1))
+THREADS = int(os.environ.get('MASTERBLOG_THREADS', 4))
+# Seconds an idle keep-alive connection may hold a thread of a forked worker
+KEEPALIVE_TIMEOUT = float(os.environ.get('MASTERBLOG_KEEPALIVE_TIMEOUT', 5))
+
+
+def serve(app, host='0.0.0.0', port=5002, workers=WORKERS, threads=THREADS):
+    """
+    Serve a WSGI app with several worker processes until interrupted.
+    :param app: the WSGI app
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :param workers: the number of worker processes
+    :param threads: the number of threads per worker
+    """
+    if gunicorn is not None:
+        serve_gunicorn(app, host, port, workers, threads)
+    else:
+        serve_forked(app, host, port, workers, threads)
+
+
+def serve_gunicorn(app, host, port, workers, threads):
+    """ Serve the app with gunicorn gthread workers """
+
+    class Application(gunicorn.app.base.BaseApplication):
+        """ Runs the app with the options given here instead of the command line """
+
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    """ Closes keep-alive connections left idle, which would hold a thread of the pool """
+    timeout = KEEPALIVE_TIMEOUT
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    A Werkzeug server handling requests on a fixed pool of threads.
+    A connection is only accepted once a thread is free, until then it waits on the
+    listening socket, where another worker may pick it up.
+    """
+    multithread = True
+    _pool = None
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, handler=PooledRequestHandler, fd=fd)
+        self._free_threads = threading.Semaphore(threads)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix='request')
+
+    def get_request(self):
+        self._free_threads.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self._free_threads.release()
+            raise
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        """ Handle one connection on a thread of the pool """
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free_threads.release()
+
+    def server_close(self):
+        """ Wait for the requests being served, then close the socket """
+        # The base class also calls this to close the socket it opens before the pool
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        super().server_close()
+
+
+def serve_forked(app, host, port, workers, threads=THREADS):
+    """
+    Fork the worker processes on a shared listening socket.
+    The kernel hands each new connection to one of the workers waiting on the socket.
+    Nothing that opens the storage may run before the fork, the workers open their own.
+    SIGTERM, and SIGINT, stop the workers, which are waited for.
+    """
+    listener = socket.create_server((host, port), backlog=1024)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            _serve_worker(app, host, port, threads, listener)
+        children.append(pid)
+    previous_handler = signal.signal(
+        signal.SIGTERM, lambda signum, frame: _signal_children(children, signal.SIGTERM))
+    try:
+        while children:
+            try:
+                pid, _ = os.wait()
+            except KeyboardInterrupt:
+                _signal_children(children, signal.SIGTERM)
+                continue
+            children.remove(pid)
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        listener.close()
+
+
+def _serve_worker(app, host, port, threads, listener):
+    """ Serve requests in a forked worker until SIGTERM, then exit the process """
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = PooledWSGIServer(host, port, app, threads, fd=listener.fileno())
+    # Another worker may take the connection first, a blocking accept would then wait
+    # for the next one and hold up the shutdown
+    server.socket.setblocking(False)
+    # shutdown() waits for serve_forever() to return, so it cannot run on this thread
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+        server.server_close()
+    finally:
+        # os._exit skips the atexit handlers, write out the log records first
+        log_config.stop_logging()
+        os._exit(0)
+
+
+def _signal_children(children, signum):
+    """ Send a signal to each worker process still running """
+    for pid in children:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
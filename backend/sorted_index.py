@@ -0,0 +1,154 @@
+"""
+Sorted indexes for listing the blog posts in order of a field.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Sequence
+import math
+
+SORT_FIELDS = ('title', 'content', 'author', 'date')
+
+
+class SortedIndex:
+    """
+    Keeps the posts sorted by one field, or in insertion order when the field is None.
+    Entries are (value, sequence, post) tuples, the value as given by Post.sort_value.
+    The sequence is the position of the post in the insertion order, so posts with equal
+    values keep their insertion order, the same as a stable sort would leave them.
+    An index may keep only the first characters of long values, such as the content of
+    posts held without it, see prefix_length.
+    """
+
+    def __init__(self, field, prefix_length=None):
+        """
+        :param prefix_length: (int) how much of each value to sort by, None for all of it.
+            Posts whose values start the same are then only in insertion order among
+            themselves, see truncated_runs().
+        """
+        self.field = field
+        self.prefix_length = prefix_length
+        self.entries = []
+
+    def _value(self, sequence, post):
+        """ Return the value the post is sorted by """
+        if self.field is None:
+            return sequence
+        value = post.sort_value(self.field)
+        return value if self.prefix_length is None else value[:self.prefix_length]
+
+    def build(self, sequenced_posts):
+        """
+        Fill the index from scratch.
+        :param sequenced_posts: (sequence, post, held post) triples, the held post is the
+            one kept in the entry, the post the one its value is taken from
+        """
+        self.entries = sorted((self._value(sequence, post), sequence, held_post)
+                              for sequence, post, held_post in sequenced_posts)
+
+    def add(self, sequence, post, held_post=None):
+        """ Insert a post at its place in the order, keeping held_post in the entry if given """
+        insort(self.entries, (self._value(sequence, post), sequence,
+                              post if held_post is None else held_post))
+
+    def truncated_runs(self):
+        """
+        Return the runs of entries whose values have been cut to the same prefix.
+        :return: (list) (start, stop) slices of the entries
+        """
+        runs = []
+        entries = self.entries
+        start = 0
+        for index in range(1, len(entries) + 1):
+            if index < len(entries) and entries[index][0] == entries[start][0]:
+                continue
+            if index - start > 1 and len(entries[start][0]) >= self.prefix_length:
+                runs.append((start, index))
+            start = index
+        return runs
+
+    def range(self, low=None, high=None):
+        """
+        Return the entries with values from low to high, both included, found by bisecting.
+        :param low: the lowest value, None for no lower bound
+        :param high: the highest value, None for no upper bound
+        """
+        entries = self.entries
+        start = 0 if low is None else bisect_left(entries, (low,))
+        stop = len(entries) if high is None else bisect_right(entries, (high, math.inf))
+        return entries[start:stop]
+
+    def remove(self, sequence, post):
+        """ Remove a post. The post must hold the value it was indexed with. """
+        index = bisect_left(self.entries, (self._value(sequence, post), sequence))
+        if index < len(self.entries) and self.entries[index][1] == sequence:
+            del self.entries[index]
+
+
+class SortedPosts(Sequence):
+    """
+    A read-only view of the posts in the order of a list of sorted entries.
+    Indexing and slicing only touch the entries asked for, so a page of posts costs the
+    same whatever its position or the direction of the order.
+    """
+
+    def __init__(self, entries, reverse=False):
+        self._entries = entries
+        self._reverse = reverse
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, item):
+        entries = self._entries
+        count = len(entries)
+        if isinstance(item, slice):
+            start, stop, step = item.indices(count)
+            if step != 1:
+                return [self[index] for index in range(start, stop, step)]
+            if not self._reverse:
+                return [entry[2] for entry in entries[start:stop]]
+            chunk = entries[max(count - stop, 0):max(count - start, 0)]
+            return [entry[2] for entry in reversed(chunk)]
+        return self._entry(item)[2]
+
+    def _entry(self, item):
+        """ Return the entry at a position of the view """
+        count = len(self._entries)
+        if item < 0:
+            item += count
+        if not 0 <= item < count:
+            raise IndexError('post index out of range')
+        return self._entries[count - 1 - item if self._reverse else item]
+
+    def key(self, item):
+        """ Return the (value, sequence) key of the post at a position of the view """
+        return self._entry(item)[:2]
+
+    def page(self, start, count):
+        """
+        Return the posts of a page of the view with the key of its last post.
+        Both come from the same slice of the entries, so they agree even when the posts
+        change meanwhile.
+        :return: (tuple) the list of posts and the (value, sequence) key of the last post,
+            None if the page is empty
+        """
+        entries = self._entries
+        total = len(entries)
+        if self._reverse:
+            chunk = entries[max(total - start - count, 0):max(total - start, 0)]
+            chunk.reverse()
+        else:
+            chunk = entries[start:start + count]
+        return [entry[2] for entry in chunk], chunk[-1][:2] if chunk else None
+
+    def index_after(self, key):
+        """
+        Return the position of the first post that comes after the key in the view.
+        The key does not need to belong to a post that still exists.
+        """
+        key = tuple(key)
+        index = bisect_left(self._entries, key)
+        if self._reverse:
+            return len(self._entries) - index
+        if index < len(self._entries) and self._entries[index][:2] == key:
+            index += 1
+        return index
@@ -0,0 +1,950 @@
+"""
+Storage backends that persist the blog posts.
+
+A storage only persists posts. The posts are served from memory by the PostStore in
+posts.py, which asks its storage for a signature on every access to find out whether
+another process has changed the posts.
+"""
+import argparse
+from contextlib import contextmanager
+import logging
+import mmap
+import os
+from pathlib import Path
+import sqlite3
+import struct
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows, only threads within one process are locked out
+    fcntl = None
+try:
+    import backend.json_codec as json_codec
+except ModuleNotFoundError:
+    import json_codec
+
+logger = logging.getLogger(__name__)
+
+STORAGE_MODES = ('json', 'journal', 'sqlite', 'snapshot')
+POST_FIELDS = ('title', 'author', 'date', 'content')
+SNAPSHOT_MAGIC = b'MBSNAP01'
+# The header of a snapshot holds the magic and the number of posts
+SNAPSHOT_HEADER = struct.Struct('<8sQ')
+# An entry of the offset table, the id of a post and the offset and length of its record
+SNAPSHOT_ENTRY = struct.Struct('<qQI')
+
+
+def read_json(post_file):
+    """ Read posts from a json file, an empty or broken file has no posts """
+    try:
+        with open(post_file, 'r', encoding='utf-8') as json_file:
+            return json_codec.load(json_file)
+    except FileNotFoundError:
+        write_json([], post_file)
+        return []
+    except Exception as e:
+        logger.error(f"Error: {e}. Unable to read posts from {post_file}. It is not a json file.")
+        return []
+
+
+def file_mode(path):
+    """ Return the permissions of a file, or those open() would give it if it is missing """
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        # The umask can only be read by setting it
+        umask = os.umask(0o022)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@contextmanager
+def replacing(path, mode='w'):
+    """
+    Open a temporary file which replaces the file at path once it has been written, so a
+    crash never leaves a truncated file behind.
+    :param mode: 'w' for a text file, 'wb' for a binary one
+    """
+    path = Path(path)
+    handle, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.',
+                                         suffix='.tmp')
+    try:
+        # mkstemp makes the file private, give it the mode of the file it replaces
+        os.fchmod(handle, file_mode(path))
+        with os.fdopen(handle, mode, encoding=None if 'b' in mode else 'utf-8') as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
+def write_json(posts, post_file):
+    """ Write posts to a json file, atomically """
+    with replacing(post_file) as json_file:
+        json_codec.dump(posts, json_file)
+
+
+def encode_record(post):
+    """ Encode a post as a snapshot record """
+    return json_codec.dumps(post).encode('utf-8')
+
+
+def write_snapshot(records, snapshot_file):
+    """
+    Write a binary snapshot of the posts, atomically.
+    The snapshot starts with a header and a table of fixed-width (id, offset, length)
+    entries sorted by id, followed by the records in insertion order. Each record is a
+    post encoded as JSON.
+    :param records: (id, bytes) of every post in insertion order
+    """
+    records = list(records)
+    entries = []
+    offset = SNAPSHOT_HEADER.size + SNAPSHOT_ENTRY.size * len(records)
+    for post_id, record in records:
+        entries.append((int(post_id), offset, len(record)))
+        offset += len(record)
+    entries.sort()
+    with replacing(snapshot_file, 'wb') as snapshot:
+        snapshot.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(records)))
+        snapshot.write(b''.join(SNAPSHOT_ENTRY.pack(*entry) for entry in entries))
+        for _, record in records:
+            snapshot.write(record)
+
+
+class Snapshot:
+    """
+    A binary snapshot of the posts mapped into memory, see write_snapshot().
+    A post is found by a binary search of the offset table and only its record is
+    decoded, the rest of the file is never parsed.
+    """
+
+    def __init__(self, snapshot_file):
+        with open(snapshot_file, 'rb') as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ValueError(f'{snapshot_file} is empty') from None
+        if (len(self._map) < SNAPSHOT_HEADER.size
+                or SNAPSHOT_HEADER.unpack_from(self._map)[0] != SNAPSHOT_MAGIC):
+            raise ValueError(f'{snapshot_file} is not a snapshot of blog posts')
+        self._count = SNAPSHOT_HEADER.unpack_from(self._map)[1]
+        # Slices of a memoryview point into the map instead of copying the bytes
+        self._view = memoryview(self._map)
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, index):
+        """ Return the (id, offset, length) entry at an index of the offset table """
+        return SNAPSHOT_ENTRY.unpack_from(self._map,
+                                          SNAPSHOT_HEADER.size + index * SNAPSHOT_ENTRY.size)
+
+    def record(self, post_id):
+        """ Return the record of the post with the id as a memoryview, or None """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < post_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._count:
+            return None
+        entry_id, offset, length = self._entry(low)
+        if entry_id != post_id:
+            return None
+        return self._view[offset:offset + length]
+
+    def read(self, post_id):
+        """ Return the post with the id or None """
+        record = self.record(post_id)
+        return None if record is None else json_codec.loads(record)
+
+    def entries(self):
+        """ Return the (id, offset, length) entries of the offset table, sorted by id """
+        table = self._view[SNAPSHOT_HEADER.size:
+                           SNAPSHOT_HEADER.size + self._count * SNAPSHOT_ENTRY.size]
+        return list(SNAPSHOT_ENTRY.iter_unpack(table))
+
+    def records(self):
+        """ Return (id, memoryview) of every record in insertion order """
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        return [(post_id, self._view[offset:offset + length])
+                for post_id, offset, length in entries]
+
+    def changes_since(self, old):
+        """
+        Compare the snapshot with an older one, record by record.
+        :param old: (Snapshot) the older snapshot
+        :return: (tuple) the (post id, post) changes, the post None for a deleted post,
+            new posts in insertion order, and the old contents of the changed posts by id
+        """
+        old_entries = {post_id: (offset, length) for post_id, offset, length in old.entries()}
+        changed = []
+        for post_id, offset, length in self.entries():
+            old_entry = old_entries.pop(post_id, None)
+            if (old_entry is not None and old_entry[1] == length
+                    and old._view[old_entry[0]:old_entry[0] + length].tobytes()
+                    == self._view[offset:offset + length].tobytes()):
+                continue
+            changed.append((offset, post_id, length))
+        changed.sort()
+        changes = [(post_id, None) for post_id in old_entries]
+        changes.extend((post_id, json_codec.loads(self._view[offset:offset + length]))
+                       for offset, post_id, length in changed)
+        old_contents = {}
+        for post_id, _ in changes:
+            old_post = old.read(post_id)
+            if old_post is not None:
+                old_contents[post_id] = old_post.get('content')
+        return changes, old_contents
+
+    def posts(self):
+        """ Return every post in insertion order """
+        return [json_codec.loads(record) for _, record in self.records()]
+
+
+class Storage:
+    """
+    The interface of the storage backends.
+    Writes are made inside lock(), which the PostStore holds over its whole
+    read-modify-write cycle. The lock must be reentrant for the thread holding it.
+    """
+
+    def lock(self):
+        """ Return a context manager holding an exclusive lock across processes """
+        raise NotImplementedError
+
+    def signature(self):
+        """ Return a value that changes whenever the stored posts change, None if there are none """
+        raise NotImplementedError
+
+    def load(self):
+        """ Return every stored post in insertion order """
+        raise NotImplementedError
+
+    def changes(self):
+        """
+        Return the changes made since the posts were last loaded or since the last call,
+        so that a process can catch up without loading every post again. Writes made
+        through the storage itself are not returned.
+        :return: (tuple) the list of (post id, post) changes in the order they were made,
+            the post None for a deleted post, and a dict of the contents the changed
+            posts had before, for the storages that do not hand back the content with
+            the posts. None if the changes are not known and every post must be loaded.
+        """
+        return None
+
+    def put(self, post, posts_by_id):
+        """
+        Persist a post that has been added or updated.
+        :param post: (dict) the post
+        :param posts_by_id: (dict) all the posts after the change, for storages that
+            write every post at once
+        """
+        raise NotImplementedError
+
+    def put_many(self, posts, posts_by_id):
+        """ Persist many added or updated posts with as few writes as possible, see put() """
+        with self.lock():
+            for post in posts:
+                self.put(post, posts_by_id)
+
+    def delete(self, post_id, posts_by_id):
+        """ Persist the removal of a post, see put() """
+        raise NotImplementedError
+
+
+class JsonStorage(Storage):
+    """ Keeps the posts in a json file which is rewritten on every change """
+
+    def __init__(self, post_file):
+        self.post_file = Path(post_file)
+        self.lock_file = self.post_file.with_suffix('.lock')
+        self._lock = threading.RLock()
+        self._lock_handle = None
+        self._lock_depth = 0
+
+    @contextmanager
+    def lock(self):
+        """ Hold the thread lock and the exclusive lock on the lock file """
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_handle is None:
+                    self._lock_handle = open(self.lock_file, 'a', encoding='utf-8')
+                fcntl.flock(self._lock_handle, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_handle, fcntl.LOCK_UN)
+
+    def _files(self):
+        """ The files whose changes mean that the posts have changed """
+        return [self.post_file]
+
+    def signature(self):
+        """
+        Return (inode, mtime, size) of each of the files or None if there is no posts file.
+        Every rewrite replaces the file with a new one, so the inode changes with it even
+        when the size does and the mtime is too coarse to.
+        """
+        signature = []
+        files = self._files()
+        for file in files:
+            try:
+                stat = os.stat(file)
+            except OSError:
+                if file == files[0]:
+                    return None
+                signature.append(None)
+                continue
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def load(self):
+        return read_json(self.post_file)
+
+    def put(self, post, posts_by_id):
+        with self.lock():
+            write_json(list(posts_by_id.values()), self.post_file)
+
+    def put_many(self, posts, posts_by_id):
+        with self.lock():
+            write_json(list(posts_by_id.values()), self.post_file)
+
+    def delete(self, post_id, posts_by_id):
+        with self.lock():
+            write_json(list(posts_by_id.values()), self.post_file)
+
+
+class JournalStorage(JsonStorage):
+    """
+    Keeps a json snapshot of the posts plus a journal of the changes made since.
+    A change appends one record to the journal instead of rewriting the whole file. The
+    journal is folded into a new snapshot by a background compaction once it holds
+    compact_threshold records.
+    """
+
+    def __init__(self, post_file, compact_threshold=1000):
+        super().__init__(post_file)
+        self.journal_file = self.post_file.with_suffix('.journal')
+        self.compact_threshold = compact_threshold
+        self._compacting_file = self.post_file.with_suffix('.journal.compacting')
+        self._journal_records = 0
+        self._compaction = None
+        self._compaction_lock = threading.Lock()
+        # How far each journal file, by inode, has been read, and the snapshot it goes on
+        self._positions = {}
+        self._snapshot_stat = None
+
+    def _files(self):
+        return [self.post_file, self._compacting_file, self.journal_file]
+
+    @staticmethod
+    def _stat(file):
+        """ Return what tells one version of a file from another, None if it is missing """
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """ Return the snapshot with the journal records applied to it """
+        self._snapshot_stat = self._stat(self.post_file)
+        posts_by_id = {int(post.get('id')): post for post in read_json(self.post_file)}
+        self._positions = {}
+        self._replay(self._compacting_file, posts_by_id, self._positions)
+        self._journal_records = self._replay(self.journal_file, posts_by_id, self._positions)
+        return list(posts_by_id.values())
+
+    def changes(self):
+        """
+        Return the journal records appended since the last read. A new snapshot means
+        that a compaction has folded records in which may not have been read, so then
+        the changes are not known.
+        """
+        if self._snapshot_stat is None or self._stat(self.post_file) != self._snapshot_stat:
+            return None
+        changes = []
+        read_inodes = set()
+        for journal_file in (self._compacting_file, self.journal_file):
+            inode, records = self._read_records(journal_file, self._positions)
+            read_inodes.add(inode)
+            for record in records:
+                if record.get('op') == 'put':
+                    changes.append((int(record['post']['id']), record['post']))
+                elif record.get('op') == 'delete':
+                    changes.append((int(record['id']), None))
+        # The journals that are gone were folded into the snapshot
+        self._positions = {inode: position for inode, position in self._positions.items()
+                           if inode in read_inodes}
+        return changes, {}
+
+    @staticmethod
+    def _read_records(journal_file, positions):
+        """
+        Read the records of a journal from where the last read of the same file stopped.
+        Only whole lines are read, a record still being appended is left for later.
+        :param positions: (dict) the offset read up to in each journal by inode, updated
+        :return: (tuple) the inode of the journal, None if there is none, and its records
+        """
+        try:
+            with open(journal_file, 'rb') as journal:
+                inode = os.fstat(journal.fileno()).st_ino
+                start = positions.get(inode, 0)
+                journal.seek(start)
+                data = journal.read()
+        except FileNotFoundError:
+            return None, []
+        end = data.rfind(b'\n') + 1
+        positions[inode] = start + end
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json_codec.loads(line))
+            except ValueError:
+                logger.error('Skipping a broken record in %s', journal_file)
+        return inode, records
+
+    @classmethod
+    def _replay(cls, journal_file, posts_by_id, positions=None):
+        """
+        Apply the records of a journal to the posts.
+        Every record sets the final state of one post, so replaying records which are
+        already part of the snapshot is harmless.
+        :param positions: (dict) the offsets read up to by inode, see _read_records()
+        :return: (int) the number of records replayed
+        """
+        _, records = cls._read_records(journal_file, {} if positions is None else positions)
+        for record in records:
+            # Updated posts keep their place in the insertion order
+            if record.get('op') == 'put':
+                posts_by_id[int(record['post']['id'])] = record['post']
+            elif record.get('op') == 'delete':
+                posts_by_id.pop(int(record['id']), None)
+        return len(records)
+
+    def put(self, post, posts_by_id):
+        self._append([{'op': 'put', 'post': post}])
+
+    def put_many(self, posts, posts_by_id):
+        self._append([{'op': 'put', 'post': post} for post in posts])
+
+    def delete(self, post_id, posts_by_id):
+        self._append([{'op': 'delete', 'id': int(post_id)}])
+
+    def _append(self, records):
+        """ Append records to the journal in one write and start a compaction if it is due """
+        data = ''.join(json_codec.dumps(record) + '\n' for record in records).encode('utf-8')
+        with self.lock():
+            with open(self.journal_file, 'ab') as journal:
+                stat = os.fstat(journal.fileno())
+                journal.write(data)
+            # Our own records need no catching up with when nothing came before them
+            if self._positions.get(stat.st_ino, 0) == stat.st_size:
+                self._positions[stat.st_ino] = stat.st_size + len(data)
+            self._journal_records += len(records)
+            if (self._journal_records >= self.compact_threshold
+                    and (self._compaction is None or not self._compaction.is_alive())):
+                self._compaction = threading.Thread(target=self.compact, daemon=True)
+                self._compaction.start()
+
+    def compact(self):
+        """
+        Fold the journal into a new snapshot of the posts file.
+        The journal is moved aside under the lock so that new changes go to a fresh
+        journal while the snapshot is written outside of the lock. Only one compaction
+        runs at a time across all processes.
+        """
+        if not self._compaction_lock.acquire(blocking=False):
+            return
+        try:
+            with open(self.lock_file.with_suffix('.compaction.lock'), 'a',
+                      encoding='utf-8') as compaction_lock:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(compaction_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return
+                self._compact()
+        finally:
+            self._compaction_lock.release()
+
+    def _compact(self):
+        """ Write the snapshot and drop the journal records it contains """
+        with self.lock():
+            if not self.journal_file.exists() and not self._compacting_file.exists():
+                return
+            if not self._compacting_file.exists():
+                os.replace(self.journal_file, self._compacting_file)
+            elif self.journal_file.exists():
+                # An earlier compaction did not finish, keep its records as well
+                with open(self._compacting_file, 'a', encoding='utf-8') as compacting, \
+                        open(self.journal_file, 'r', encoding='utf-8') as journal:
+                    compacting.write(journal.read())
+                os.remove(self.journal_file)
+            self._journal_records = 0
+        # Only compactions touch the snapshot and the compacting file, so they can be
+        # read and written without holding up the writers
+        posts_by_id = {int(post.get('id')): post for post in read_json(self.post_file)}
+        self._replay(self._compacting_file, posts_by_id)
+        write_json(list(posts_by_id.values()), self.post_file)
+        with self.lock():
+            os.remove(self._compacting_file)
+        logger.info('Compacted the journal of %s', self.post_file)
+
+
+class SqliteStorage(Storage):
+    """
+    Keeps the posts in an SQLite database in WAL mode.
+    Posts are indexed on id, author and date, and their content is indexed for substring
+    search with an FTS5 trigram table. A version counter maintained by triggers changes
+    with every commit from any process, and the triggers log the posts each version
+    changed, with the content they had, for the other processes to catch up with.
+    """
+
+    # How many versions of changes to keep in the log
+    CHANGE_LOG_VERSIONS = 1000
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY,
+            position INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            date TEXT NOT NULL,
+            content TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS posts_position ON posts (position);
+        CREATE INDEX IF NOT EXISTS posts_author ON posts (author);
+        CREATE INDEX IF NOT EXISTS posts_date ON posts (date);
+        CREATE TABLE IF NOT EXISTS meta (version INTEGER NOT NULL);
+        INSERT INTO meta (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM meta);
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5 (
+            content, content='posts', content_rowid='id', tokenize='trigram'
+        );
+        CREATE TABLE IF NOT EXISTS post_changes (
+            version INTEGER PRIMARY KEY,
+            id INTEGER NOT NULL,
+            old_content TEXT
+        );
+        DROP TRIGGER IF EXISTS posts_insert;
+        CREATE TRIGGER posts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, content) VALUES (new.id, new.content);
+            UPDATE meta SET version = version + 1;
+            INSERT INTO post_changes (version, id) SELECT version, new.id FROM meta;
+        END;
+        DROP TRIGGER IF EXISTS posts_delete;
+        CREATE TRIGGER posts_delete AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            UPDATE meta SET version = version + 1;
+            INSERT INTO post_changes (version, id, old_content)
+                SELECT version, old.id, old.content FROM meta;
+        END;
+        DROP TRIGGER IF EXISTS posts_update;
+        CREATE TRIGGER posts_update AFTER UPDATE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            INSERT INTO posts_fts (rowid, content) VALUES (new.id, new.content);
+            UPDATE meta SET version = version + 1;
+            INSERT INTO post_changes (version, id, old_content)
+                SELECT version, old.id, old.content FROM meta;
+        END;
+    """
+
+    UPSERT = """
+        INSERT INTO posts (id, position, title, author, date, content)
+        VALUES (:id, (SELECT coalesce(max(position), 0) + 1 FROM posts),
+                :title, :author, :date, :content)
+        ON CONFLICT (id) DO UPDATE SET
+            title = excluded.title, author = excluded.author,
+            date = excluded.date, content = excluded.content
+    """
+
+    def __init__(self, db_file):
+        self.db_file = Path(db_file)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        # The version the posts were last loaded or caught up at, None before loading
+        self._version = None
+        # The connection is shared by the threads, which take turns through the lock
+        self._connection = sqlite3.connect(self.db_file, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._lock:
+            self._connection.executescript(f'BEGIN IMMEDIATE; {self.SCHEMA} COMMIT;')
+
+    @contextmanager
+    def lock(self):
+        """ Hold a write transaction, which SQLite grants to one connection at a time """
+        with self._lock:
+            if self._lock_depth == 0:
+                self._connection.execute('BEGIN IMMEDIATE')
+            self._lock_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._connection.execute('ROLLBACK')
+                raise
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                self._connection.execute('COMMIT')
+
+    @contextmanager
+    def _reading(self):
+        """ Hold a read transaction, so that every query sees the same version """
+        with self._lock:
+            if self._lock_depth > 0:
+                yield
+                return
+            self._connection.execute('BEGIN')
+            try:
+                yield
+            finally:
+                self._connection.execute('COMMIT')
+
+    def _current_version(self):
+        return self._connection.execute('SELECT version FROM meta').fetchone()[0]
+
+    def signature(self):
+        with self._lock:
+            return self._current_version()
+
+    def load(self):
+        with self._reading():
+            rows = self._connection.execute(
+                'SELECT id, title, author, date, content FROM posts ORDER BY position'
+            ).fetchall()
+            self._version = self._current_version()
+        return [dict(zip(('id',) + POST_FIELDS, row)) for row in rows]
+
+    def changes(self):
+        """
+        Return the posts changed since the version last loaded or caught up at, as
+        logged by the triggers. The changes are not known once the log has been pruned
+        past that version.
+        """
+        with self._reading():
+            if self._version is None:
+                return None
+            version = self._current_version()
+            if version == self._version:
+                return [], {}
+            oldest = self._connection.execute(
+                'SELECT min(version) FROM post_changes').fetchone()[0]
+            if oldest is None or oldest > self._version + 1:
+                return None
+            # The content a post had before its first change since the version
+            old_contents = {}
+            for post_id, old_content in self._connection.execute(
+                    'SELECT id, old_content FROM post_changes WHERE version > ? '
+                    'ORDER BY version DESC', (self._version,)):
+                old_contents[post_id] = old_content
+            post_ids = list(old_contents)
+            posts = []
+            for start in range(0, len(post_ids), 500):
+                chunk = post_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                posts.extend(self._connection.execute(
+                    f'SELECT position, id, title, author, date, content FROM posts '
+                    f'WHERE id IN ({placeholders})', chunk))
+            self._version = version
+        posts.sort()
+        present = {row[1] for row in posts}
+        changes = [(post_id, None) for post_id in post_ids if post_id not in present]
+        changes.extend((row[1], dict(zip(('id',) + POST_FIELDS, row[1:]))) for row in posts)
+        return changes, {post_id: old_content for post_id, old_content in old_contents.items()
+                         if old_content is not None}
+
+    @contextmanager
+    def _writing(self):
+        """
+        Hold the lock over a write, then prune the change log and skip our own changes
+        when catching up, unless there were changes by others to catch up with first.
+        """
+        with self.lock():
+            before = self._current_version()
+            yield
+            after = self._current_version()
+            if after != before:
+                self._connection.execute('DELETE FROM post_changes WHERE version <= ?',
+                                         (after - self.CHANGE_LOG_VERSIONS,))
+            if self._version == before:
+                self._version = after
+
+    def put(self, post, posts_by_id):
+        with self._writing():
+            self._connection.execute(self.UPSERT, {'id': int(post['id']),
+                                                   **{field: post[field] for field in POST_FIELDS}})
+
+    def put_many(self, posts, posts_by_id=None):
+        """ Store many posts in one transaction """
+        with self._writing():
+            self._connection.executemany(self.UPSERT, (
+                {'id': int(post['id']), **{field: post[field] for field in POST_FIELDS}}
+                for post in posts
+            ))
+
+    def delete(self, post_id, posts_by_id):
+        with self._writing():
+            self._connection.execute('DELETE FROM posts WHERE id = ?', (int(post_id),))
+
+    def contents(self, post_ids=None):
+        """
+        Read the content of posts on demand. The content is the last column of a row, so
+        reading the other columns never touches it.
+        :param post_ids: the ids of the posts, None for every post
+        :return: (dict) the contents by post id, posts that do not exist are left out
+        """
+        with self._lock:
+            if post_ids is None:
+                return dict(self._connection.execute('SELECT id, content FROM posts'))
+            post_ids = [int(post_id) for post_id in post_ids]
+            contents = {}
+            # Stay well below the limit on the number of SQL parameters
+            for start in range(0, len(post_ids), 500):
+                chunk = post_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                contents.update(self._connection.execute(
+                    f'SELECT id, content FROM posts WHERE id IN ({placeholders})', chunk))
+            return contents
+
+    def search_content(self, text):
+        """
+        Return the ids of the posts whose content contains the text, ignoring case.
+        The trigram index needs at least three characters, None is returned for less.
+        """
+        if len(text) < 3:
+            return None
+        phrase = '"' + text.replace('"', '""') + '"'
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?', (phrase,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+
+class SnapshotStorage(JsonStorage):
+    """
+    Keeps the posts in a binary snapshot which is mapped into memory, see Snapshot.
+    Single posts and their content are read from the map without loading the other
+    posts. A change writes a new snapshot, copying the records of the posts that did not
+    change as they are.
+    """
+
+    def __init__(self, post_file):
+        super().__init__(post_file)
+        self.snapshot_file = self.post_file.with_suffix('.snap')
+        self._snapshot = None
+        self._snapshot_signature = None
+        # The snapshot the posts were last loaded from or caught up with
+        self._synced = None
+
+    def _files(self):
+        return [self.snapshot_file]
+
+    def _mapped(self):
+        """ Return the current snapshot mapped into memory, None if there is none """
+        with self._lock:
+            signature = self.signature()
+            if signature is None:
+                return None
+            if signature != self._snapshot_signature:
+                # A map of a replaced file stays valid, it is dropped once nothing uses it
+                self._snapshot = Snapshot(self.snapshot_file)
+                self._snapshot_signature = signature
+            return self._snapshot
+
+    def load(self):
+        """ Return every post, making the snapshot from the posts file if there is none """
+        if not self.snapshot_file.exists():
+            with self.lock():
+                if not self.snapshot_file.exists():
+                    json_to_snapshot(self.post_file, self.snapshot_file)
+        # Snapshots are replaced whole, so the one mapped can be read without the lock
+        try:
+            with self._lock:
+                self._synced = self._mapped()
+            return self._synced.posts()
+        except (ValueError, struct.error) as e:
+            logger.error(f"Error: {e}. Unable to read posts from {self.snapshot_file}.")
+            return []
+
+    def changes(self):
+        """ Return the posts changed between the snapshot last synced with and the current one """
+        with self._lock:
+            old = self._synced
+            try:
+                current = self._mapped()
+            except (ValueError, struct.error):
+                return None
+            if old is None or current is None:
+                return None
+            self._synced = current
+        if current is old:
+            return [], {}
+        return current.changes_since(old)
+
+    def put(self, post, posts_by_id):
+        self._write({int(post['id']): post}, posts_by_id)
+
+    def put_many(self, posts, posts_by_id):
+        self._write({int(post['id']): post for post in posts}, posts_by_id)
+
+    def delete(self, post_id, posts_by_id):
+        self._write({}, posts_by_id)
+
+    def _write(self, changed, posts_by_id):
+        """
+        Write a snapshot of the posts. Only the changed posts are encoded, the records of
+        the others are copied from the current snapshot, so they are written out whole
+        even when the posts in memory are held without their content.
+        :param changed: (dict) the added or updated posts by id
+        :param posts_by_id: (dict) all the posts after the change
+        """
+        with self.lock():
+            snapshot = self._mapped()
+            synced = self._synced is snapshot
+            records = []
+            for post_id, post in posts_by_id.items():
+                record = None
+                if post_id not in changed and snapshot is not None:
+                    record = snapshot.record(post_id)
+                if record is None:
+                    record = encode_record(changed.get(post_id, post))
+                records.append((post_id, record))
+            write_snapshot(records, self.snapshot_file)
+            # Our own changes need no catching up with when nothing came before them
+            if synced:
+                self._synced = self._mapped()
+
+    def read_post(self, post_id):
+        """ Return the post with the id, decoding only its record, or None """
+        with self._lock:
+            snapshot = self._mapped()
+            return None if snapshot is None else snapshot.read(int(post_id))
+
+    def contents(self, post_ids=None):
+        """
+        Read the content of posts from their records.
+        :param post_ids: the ids of the posts, None for every post
+        :return: (dict) the contents by post id, posts that do not exist are left out
+        """
+        with self._lock:
+            snapshot = self._mapped()
+            if snapshot is None:
+                return {}
+            if post_ids is None:
+                records = snapshot.records()
+            else:
+                records = ((int(post_id), snapshot.record(int(post_id))) for post_id in post_ids)
+            return {post_id: json_codec.loads(record).get('content')
+                    for post_id, record in records if record is not None}
+
+
+def open_storage(post_file, storage_mode='json', compact_threshold=1000):
+    """
+    Return the storage for a posts file.
+    The sqlite storage keeps its database next to the posts file, with a .db suffix, and
+    the snapshot storage its snapshot with a .snap suffix.
+    """
+    match storage_mode:
+        case 'json':
+            return JsonStorage(post_file)
+        case 'journal':
+            return JournalStorage(post_file, compact_threshold)
+        case 'sqlite':
+            return SqliteStorage(Path(post_file).with_suffix('.db'))
+        case 'snapshot':
+            return SnapshotStorage(post_file)
+    raise ValueError(f'Unknown storage mode {storage_mode}, use one of {STORAGE_MODES}')
+
+
+def migrate(post_file, db_file):
+    """
+    Import the posts of a json posts file into an SQLite database.
+    :return: (int) the number of posts imported
+    """
+    posts = read_json(post_file)
+    SqliteStorage(db_file).put_many(posts)
+    return len(posts)
+
+
+def json_to_snapshot(post_file, snapshot_file):
+    """
+    Write the posts of a json posts file as a binary snapshot. A missing posts file
+    makes an empty snapshot.
+    :return: (int) the number of posts written
+    """
+    posts_by_id = {}
+    if Path(post_file).exists():
+        posts_by_id = {int(post.get('id')): post for post in read_json(post_file)}
+    write_snapshot(((post_id, encode_record(post)) for post_id, post in posts_by_id.items()),
+                   snapshot_file)
+    return len(posts_by_id)
+
+
+def snapshot_to_json(snapshot_file, post_file):
+    """
+    Write the posts of a binary snapshot as a json posts file.
+    :return: (int) the number of posts written
+    """
+    posts = Snapshot(snapshot_file).posts()
+    write_json(posts, post_file)
+    return len(posts)
+
+
+def main():
+    """
+    Command line entry point:
+        python -m backend.storage migrate posts.json posts.db
+        python -m backend.storage snapshot posts.json posts.snap
+        python -m backend.storage unsnapshot posts.snap posts.json
+    """
+    parser = argparse.ArgumentParser(description='Manage the blog post storage.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = commands.add_parser('migrate', help='Import a posts.json into SQLite')
+    migrate_parser.add_argument('post_file', type=Path)
+    migrate_parser.add_argument('db_file', type=Path, nargs='?',
+                                help='Defaults to the posts file with a .db suffix')
+    snapshot_parser = commands.add_parser('snapshot',
+                                          help='Convert a posts.json into a binary snapshot')
+    snapshot_parser.add_argument('post_file', type=Path)
+    snapshot_parser.add_argument('snapshot_file', type=Path, nargs='?',
+                                 help='Defaults to the posts file with a .snap suffix')
+    unsnapshot_parser = commands.add_parser('unsnapshot',
+                                            help='Convert a binary snapshot into a posts.json')
+    unsnapshot_parser.add_argument('snapshot_file', type=Path)
+    unsnapshot_parser.add_argument('post_file', type=Path, nargs='?',
+                                   help='Defaults to the snapshot with a .json suffix')
+    args = parser.parse_args()
+    match args.command:
+        case 'migrate':
+            db_file = args.db_file or args.post_file.with_suffix('.db')
+            count = migrate(args.post_file, db_file)
+            print(f'Imported {count} posts from {args.post_file} into {db_file}.')
+        case 'snapshot':
+            snapshot_file = args.snapshot_file or args.post_file.with_suffix('.snap')
+            count = json_to_snapshot(args.post_file, snapshot_file)
+            print(f'Wrote {count} posts from {args.post_file} into {snapshot_file}.')
+        case 'unsnapshot':
+            post_file = args.post_file or args.snapshot_file.with_suffix('.json')
+            count = snapshot_to_json(args.snapshot_file, post_file)
+            print(f'Wrote {count} posts from {args.snapshot_file} into {post_file}.')
+
+
+if __name__ == '__main__':
+    main()
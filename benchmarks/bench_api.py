@@ -0,0 +1,274 @@
+"""
+Latency, throughput and memory benchmarks of the blog post API.
+
+Every operation is run through the Flask test client and directly against backend.posts
+on synthetic blogs of the given sizes. The results can be saved as a JSON baseline and
+later runs compared against it.
+
+Run from the repository root:
+    python -m benchmarks.bench_api --sizes 1000 10000 --save benchmarks/baseline.json
+    python -m benchmarks.bench_api --sizes 1000 10000 --baseline benchmarks/baseline.json
+"""
+import argparse
+from datetime import datetime
+import gzip
+import json
+import logging
+import math
+from pathlib import Path
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Keep the app from writing a log line per request while it is being measured
+logging.basicConfig(level=logging.WARNING)
+
+import backend.backend_app as backend_app
+import backend.compression as compression
+import backend.posts as posts
+import backend.storage as storage
+from backend.sorted_index import SORT_FIELDS
+from benchmarks.synthetic import synthetic_posts, WORDS
+
+# How many calls of each operation are traced for their peak memory
+MEMORY_ITERATIONS = 20
+PAGE_LIMIT = 10
+
+
+def new_post(rng):
+    """ Return a random post without an id """
+    post = synthetic_posts(1, seed=rng.random())[0]
+    post.pop('id')
+    return post
+
+
+def response_json(response):
+    """ Decode the JSON body of a response, compressed or not """
+    data = response.get_data()
+    match response.headers.get('Content-Encoding'):
+        case 'gzip':
+            data = gzip.decompress(data)
+        case 'br':
+            data = compression.brotli.decompress(data)
+    return json.loads(data)
+
+
+def api_operations(client, size, added_ids, accept_encoding=None):
+    """
+    Return the operations run through the Flask test client, by name.
+    Each takes a random generator and makes one request.
+    :param accept_encoding: the Accept-Encoding header to send, None for none
+    """
+    pages = max(size // PAGE_LIMIT, 1)
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+
+    def request(method, url, **kwargs):
+        response = getattr(client, method)(url, headers=headers, **kwargs)
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f'{method.upper()} {url} answered {response.status_code}')
+        return response
+
+    return {
+        'list': lambda rng: request('get', '/api/posts', query_string={
+            'page': rng.randint(1, pages), 'limit': PAGE_LIMIT}),
+        'sort': lambda rng: request('get', '/api/posts', query_string={
+            'sort': rng.choice(SORT_FIELDS), 'direction': rng.choice(('asc', 'desc')),
+            'page': rng.randint(1, pages), 'limit': PAGE_LIMIT}),
+        'search': lambda rng: request('get', '/api/posts/search', query_string={
+            'title': rng.choice(WORDS), 'limit': PAGE_LIMIT}),
+        'get': lambda rng: request('get', f'/api/posts/{rng.randint(1, size)}'),
+        'add': lambda rng: added_ids.append(
+            response_json(request('post', '/api/posts', json=new_post(rng)))['id']),
+        'update': lambda rng: request('put', f'/api/posts/{rng.randint(1, size)}',
+                                      json={'title': rng.choice(WORDS)}),
+        'delete': lambda rng: request('delete', f'/api/posts/{added_ids.pop()}'),
+    }
+
+
+def direct_operations(size, added_ids):
+    """ Return the same operations called directly on backend.posts, by name """
+    pages = max(size // PAGE_LIMIT, 1)
+
+    def page(all_posts, rng):
+        start = (rng.randint(1, pages) - 1) * PAGE_LIMIT
+        return all_posts[start:start + PAGE_LIMIT]
+
+    return {
+        'list': lambda rng: page(posts.get_all(), rng),
+        'sort': lambda rng: page(posts.get_all(rng.choice(SORT_FIELDS),
+                                               rng.choice(('asc', 'desc'))), rng),
+        'search': lambda rng: posts.search_posts(rng.choice(WORDS), None, None,
+                                                 None)[:PAGE_LIMIT],
+        'get': lambda rng: posts.get_post(rng.randint(1, size)),
+        'add': lambda rng: added_ids.append(posts.add_post(new_post(rng))['id']),
+        'update': lambda rng: posts.update_post(rng.randint(1, size),
+                                                {'title': rng.choice(WORDS)}),
+        'delete': lambda rng: posts.delete_post(added_ids.pop()),
+    }
+
+
+def percentile(sorted_timings, percent):
+    """ Return the nearest-rank percentile of sorted timings """
+    rank = math.ceil(percent / 100 * len(sorted_timings))
+    return sorted_timings[min(max(rank, 1), len(sorted_timings)) - 1]
+
+
+def measure(operation, iterations, seed):
+    """
+    Time the calls of an operation and trace the peak memory of a few more.
+    :return: (dict) the latency percentiles in ms, ops/sec and peak memory in KiB
+    """
+    rng = random.Random(seed)
+    timings = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation(rng)
+        timings.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    # Tracing slows everything down, so memory is measured apart from the timings
+    tracemalloc.start()
+    for _ in range(min(iterations, MEMORY_ITERATIONS)):
+        operation(rng)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings.sort()
+    return {
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'ops_per_sec': iterations / elapsed if elapsed else float('inf'),
+        'peak_kib': peak / 1024,
+    }
+
+
+def load_blog(directory, size, storage_mode):
+    """
+    Write a synthetic blog, point backend.posts at it and load it.
+    :return: (dict) the load time in ms and its peak memory in KiB
+    """
+    post_file = Path(directory) / 'posts.json'
+    storage.write_json(synthetic_posts(size), post_file)
+    if storage_mode == 'sqlite':
+        storage.migrate(post_file, post_file.with_suffix('.db'))
+    elif storage_mode == 'snapshot':
+        storage.json_to_snapshot(post_file, post_file.with_suffix('.snap'))
+    posts.POSTS_FILE = post_file
+    posts.STORAGE_MODE = storage_mode
+    tracemalloc.start()
+    start = time.perf_counter()
+    # A single post may be read without loading the others, a listing loads them all
+    posts.get_all()
+    load_ms = (time.perf_counter() - start) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'load_ms': load_ms, 'peak_kib': peak / 1024}
+
+
+def run(sizes, iterations, storage_mode, cache, seed, accept_encoding=None):
+    """ Run every operation on a blog of each size and return the results by size """
+    if not cache:
+        backend_app.response_cache.max_entries = 0
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+            size_results = {'load': load_blog(directory, size, storage_mode)}
+            added_ids = []
+            with backend_app.app.test_client() as client:
+                for kind, operations in (('api', api_operations(client, size, added_ids,
+                                                                accept_encoding)),
+                                         ('direct', direct_operations(size, added_ids))):
+                    for name, operation in operations.items():
+                        size_results[f'{kind}.{name}'] = measure(operation, iterations, seed)
+            results[str(size)] = size_results
+            print_results(size, size_results)
+    return results
+
+
+def print_results(size, size_results):
+    """ Print the results for one blog size as a table """
+    load = size_results['load']
+    print(f'\n{size} posts, loaded in {load["load_ms"]:.1f} ms, '
+          f'peak {load["peak_kib"]:.0f} KiB')
+    print(f'{"operation":>14} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} '
+          f'{"ops/sec":>10} {"peak KiB":>9}')
+    for name, result in size_results.items():
+        if name == 'load':
+            continue
+        print(f'{name:>14} {result["p50_ms"]:>9.3f} {result["p95_ms"]:>9.3f} '
+              f'{result["p99_ms"]:>9.3f} {result["ops_per_sec"]:>10.0f} '
+              f'{result["peak_kib"]:>9.0f}')
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline and print every operation that got slower.
+    An operation regresses when its p95 latency grows or its throughput drops by more
+    than the tolerance.
+    :return: (list) the regressions as (size, operation, metric, baseline, result)
+    """
+    regressions = []
+    for size, size_results in results.items():
+        for name, result in size_results.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None or name == 'load':
+                continue
+            if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+                regressions.append((size, name, 'p95_ms', base['p95_ms'], result['p95_ms']))
+            if result['ops_per_sec'] < base['ops_per_sec'] / (1 + tolerance):
+                regressions.append((size, name, 'ops_per_sec', base['ops_per_sec'],
+                                    result['ops_per_sec']))
+    for size, name, metric, base_value, value in regressions:
+        print(f'REGRESSION {size} posts {name} {metric}: {base_value:.3f} -> {value:.3f}')
+    if not regressions:
+        print(f'\nNo regressions beyond {tolerance:.0%} against the baseline.')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000],
+                        help='numbers of posts to benchmark, 1000 to 1000000')
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='timed calls of each operation')
+    parser.add_argument('--storage', choices=storage.STORAGE_MODES,
+                        default=posts.STORAGE_MODE)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='turn the response cache off')
+    parser.add_argument('--accept-encoding',
+                        help='Accept-Encoding header of the API requests, e.g. gzip')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', type=Path, help='save the results as a baseline')
+    parser.add_argument('--baseline', type=Path, help='compare with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against the baseline (default 0.25)')
+    args = parser.parse_args()
+    results = run(args.sizes, args.iterations, args.storage, not args.no_cache, args.seed,
+                  args.accept_encoding)
+    if args.save is not None:
+        document = {
+            'meta': {
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'storage': args.storage,
+                'cache': not args.no_cache,
+                'accept_encoding': args.accept_encoding,
+                'iterations': args.iterations,
+            },
+            'results': results,
+        }
+        args.save.write_text(json.dumps(document, indent=2), encoding='utf-8')
+        print(f'\nSaved the results to {args.save}')
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Compare the standard library json module with the fast JSON codec.
+
+Run from the repository root: python -m benchmarks.bench_json [--sizes 1000 10000 100000]
+"""
+import argparse
+import json
+import time
+import backend.json_codec as json_codec
+from benchmarks.synthetic import synthetic_posts
+
+
+def best_time(function, repeat):
+    """ Return the fastest of repeat runs of function, in milliseconds """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    codec = 'orjson' if json_codec.orjson is not None else 'json (orjson is not installed)'
+    print(f'Fast codec: {codec}')
+    print(f'{"posts":>8} {"operation":>10} {"json ms":>10} {"fast ms":>10} {"speedup":>8}')
+    for size in args.sizes:
+        posts = synthetic_posts(size)
+        document = json.dumps(posts)
+        operations = {
+            'decode': (lambda: json.loads(document), lambda: json_codec.loads(document)),
+            'encode': (lambda: json.dumps(posts, sort_keys=True, separators=(',', ':')),
+                       lambda: json_codec.dumps(posts, sort_keys=True)),
+        }
+        for name, (standard, fast) in operations.items():
+            standard_ms = best_time(standard, args.repeat)
+            fast_ms = best_time(fast, args.repeat)
+            print(f'{size:>8} {name:>10} {standard_ms:>10.2f} {fast_ms:>10.2f} '
+                  f'{standard_ms / fast_ms:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Memory held by the blog posts, as dicts and as Post records, and by a loaded store.
+
+Run from the repository root: python -m benchmarks.bench_memory [--posts 100000]
+"""
+import argparse
+import gc
+import logging
+from pathlib import Path
+import tempfile
+import tracemalloc
+
+# Keep the store from logging to the app log file
+logging.basicConfig(level=logging.WARNING)
+
+import backend.json_codec as json_codec
+import backend.posts as posts
+import backend.storage as storage
+from backend.post_record import Post
+from benchmarks.synthetic import synthetic_posts
+
+
+def traced_mib():
+    """ Return the memory currently traced, in MiB """
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--storage', choices=storage.STORAGE_MODES, default='json')
+    args = parser.parse_args()
+    document = json_codec.dumps(synthetic_posts(args.posts))
+
+    tracemalloc.start()
+    base = traced_mib()
+    loaded = json_codec.loads(document)
+    as_dicts = traced_mib() - base
+    records = [Post.from_dict(post) for post in loaded]
+    del loaded
+    as_records = traced_mib() - base
+    del records
+    tracemalloc.stop()
+
+    with tempfile.TemporaryDirectory() as directory:
+        post_file = Path(directory) / 'posts.json'
+        Path(post_file).write_text(document, encoding='utf-8')
+        if args.storage == 'sqlite':
+            storage.migrate(post_file, post_file.with_suffix('.db'))
+        elif args.storage == 'snapshot':
+            storage.json_to_snapshot(post_file, post_file.with_suffix('.snap'))
+        tracemalloc.start()
+        base = traced_mib()
+        store = posts.PostStore(post_file, storage_mode=args.storage)
+        store.sorted_posts()
+        _, peak = tracemalloc.get_traced_memory()
+        retained = traced_mib() - base
+        tracemalloc.stop()
+        del store
+
+    print(f'{args.posts} posts')
+    print(f'{"posts as dicts":>28} {as_dicts:>9.1f} MiB')
+    print(f'{"posts as Post records":>28} {as_records:>9.1f} MiB')
+    print(f'{"loaded store with indexes":>28} {retained:>9.1f} MiB '
+          f'(peak {peak / 1024 / 1024:.1f} MiB)')
+
+
+if __name__ == '__main__':
+    main()
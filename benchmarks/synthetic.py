@@ -0,0 +1,29 @@
+"""
+Synthetic blog posts for the benchmarks.
+"""
+import random
+
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit',
+         'blog', 'post', 'flask', 'python', 'päivää', 'crème', 'brûlée', 'straße',
+         '日本語', 'русский', 'ελληνικά', '🤯', '🤷‍♂️', '😘', '👍', '😴']
+AUTHORS = ['Someone', 'Somebody', 'Jack', 'Duck', 'Matti Meikäläinen', 'Zoë', '山田太郎']
+
+
+def synthetic_posts(count, seed=0):
+    """
+    Return count posts shaped like the ones in posts.json, with ids from 1.
+    Titles and contents are drawn from a mix of ASCII, accented, CJK and emoji words.
+    :param count: the number of posts
+    :param seed: the random seed, the same seed gives the same posts
+    """
+    rng = random.Random(seed)
+    return [
+        {
+            "id": post_id,
+            "title": ' '.join(rng.choices(WORDS, k=rng.randint(2, 6))).capitalize(),
+            "author": rng.choice(AUTHORS),
+            "date": f"{rng.randint(2000, 2025)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+            "content": ' '.join(rng.choices(WORDS, k=rng.randint(20, 120))),
+        }
+        for post_id in range(1, count + 1)
+    ]
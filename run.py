@@ -1,6 +1,20 @@
+import argparse
 import backend.backend_app
+import backend.server
 
 if __name__ == '__main__':
     """ Treats backend_app as a real module. Starts the Flask app here. """
+    parser = argparse.ArgumentParser(description='Run the Masterblog API.')
+    parser.add_argument('--production', action='store_true',
+                        help='serve with several worker processes instead of the debug server')
+    parser.add_argument('--workers', type=int, default=backend.server.WORKERS,
+                        help='worker processes in production mode (default: one per core)')
+    parser.add_argument('--threads', type=int, default=backend.server.THREADS,
+                        help='threads per worker in production mode')
+    args = parser.parse_args()
     app = backend.backend_app.app
-    app.run(host="0.0.0.0", port=5002, debug=True)
\ No newline at end of file
+    if args.production:
+        backend.server.serve(app, host="0.0.0.0", port=5002,
+                             workers=args.workers, threads=args.threads)
+    else:
+        app.run(host="0.0.0.0", port=5002, debug=True)
@@ -0,0 +1,9 @@
+import sys
+
+if __name__ == '__main__':
+    """ Serves the ASGI variant of the app with uvicorn. """
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('uvicorn is needed to serve the ASGI app: pip install uvicorn')
+    uvicorn.run('backend.asgi_app:app', host="0.0.0.0", port=5002)
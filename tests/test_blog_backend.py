@@ -1,7 +1,12 @@
+import asyncio
+import gzip
 import pytest
 from unittest import mock
 import json
 from pathlib import Path
+from werkzeug.test import Client
+import backend.asgi_app
+import backend.compression
 import backend.backend_app
 
 
@@ -16,10 +21,52 @@ TEST_POSTS = [
     {"title": "🤯🤷‍♂️😘👍😴", "author": "Somebody", "date": "2024-01-11", "content": "🤯🤷‍♂️😘👍😴"},
 ]
 
-@pytest.fixture(scope='session')
-def client():
+def asgi_to_wsgi(asgi_app):
+    """ Wrap an ASGI app as a WSGI app, so the test client can call it """
+    def wsgi_app(environ, start_response):
+        server_port = int(environ['SERVER_PORT'])
+        scope = {
+            'type': 'http',
+            'http_version': '1.1',
+            'method': environ['REQUEST_METHOD'],
+            'scheme': environ['wsgi.url_scheme'],
+            'path': environ['PATH_INFO'].encode('latin-1').decode('utf-8'),
+            'query_string': environ['QUERY_STRING'].encode('latin-1'),
+            'root_path': '',
+            'server': (environ['SERVER_NAME'], server_port),
+            'headers': [(name[5:].replace('_', '-').lower().encode('latin-1'),
+                         value.encode('latin-1'))
+                        for name, value in environ.items() if name.startswith('HTTP_')],
+        }
+        for name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if environ.get(name):
+                scope['headers'].append((name.replace('_', '-').lower().encode('latin-1'),
+                                         environ[name].encode('latin-1')))
+        body = environ['wsgi.input'].read()
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi_app(scope, receive, send))
+        start = messages[0]
+        start_response(f"{start['status']} ", [(name.decode('latin-1'), value.decode('latin-1'))
+                                              for name, value in start['headers']])
+        return (message['body'] for message in messages[1:])
+    return wsgi_app
+
+
+@pytest.fixture(scope='session', params=['wsgi', 'asgi'])
+def client(request):
+    """ Run the tests against both the Flask app and its ASGI variant """
     app = backend.backend_app.app
     app.config['TESTING'] = True
+    if request.param == 'asgi':
+        yield Client(asgi_to_wsgi(backend.asgi_app.app))
+        return
     with app.test_client() as client:
         yield client
 
@@ -298,4 +345,307 @@ def test_wrong_sort_fields_get_sorted_posts(client, set_posts, posts=TEST_POSTS)
     with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
         response = client.get('/api/posts', query_string=parameters)
     assert response.status_code == 400
-    assert 'error' in json.loads(response.data)
\ No newline at end of file
+    assert 'error' in json.loads(response.data)
+
+def test_get_single_post(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/3')
+    assert response.status_code == 200
+    expected_result = TEST_POSTS[2].copy()
+    expected_result['id'] = 3
+    assert response.json == expected_result
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/42')
+    assert response.status_code == 404
+
+
+def test_search_posts_match_all_and_any(client, set_posts):
+    search_criteria = {'author': 'Somebody', 'date': '2024'}
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/search', query_string=search_criteria)
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json] == [2, 4, 5, 6]
+    search_criteria['match'] = 'all'
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/search', query_string=search_criteria)
+    assert response.status_code == 200
+    assert [post['id'] for post in response.json] == [6]
+    search_criteria['match'] = 'some'
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/search', query_string=search_criteria)
+    assert response.status_code == 400
+
+
+def test_search_posts_ranked(client, set_posts):
+    search_criteria = {'rank': 'bm25', 'q': 'second post', 'limit': 2}
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/search', query_string=search_criteria)
+    assert response.status_code == 200
+    returned_posts = response.json
+    assert [post['id'] for post in returned_posts] == [2, 1]
+    assert returned_posts[0]['score'] > returned_posts[1]['score'] > 0
+    search_criteria['page'] = 2
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/search', query_string=search_criteria)
+    assert [post['id'] for post in response.json] == [3]
+    search_criteria['rank'] = 'tfidf'
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/search', query_string=search_criteria)
+    assert response.status_code == 400
+
+
+def test_get_posts_cursor_pagination(client, set_posts):
+    parameters = {'sort': 'date', 'direction': 'desc', 'limit': 4}
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts', query_string=parameters)
+        assert [post['id'] for post in response.json] == [5, 6, 4, 3]
+        parameters['cursor'] = response.headers['X-Next-Cursor']
+        # A post added before the cursor position does not shift the next page
+        client.post('/api/posts', data=json.dumps(TEST_POSTS[5]), content_type='application/json')
+        response = client.get('/api/posts', query_string=parameters)
+        assert [post['id'] for post in response.json] == [2, 1]
+        assert 'X-Next-Cursor' not in response.headers
+        parameters['cursor'] = 'not a cursor'
+        response = client.get('/api/posts', query_string=parameters)
+        assert response.status_code == 400
+
+
+def test_search_posts_cursor_pagination(client, set_posts):
+    search_criteria = {'author': 'Somebody', 'limit': 2}
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts/search', query_string=search_criteria)
+        assert [post['id'] for post in response.json] == [2, 4]
+        search_criteria['cursor'] = response.headers['X-Next-Cursor']
+        response = client.get('/api/posts/search', query_string=search_criteria)
+        assert [post['id'] for post in response.json] == [6]
+
+
+def test_get_posts_not_modified(client, set_posts):
+    parameters = {'sort': 'title'}
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts', query_string=parameters)
+        etag = response.headers['ETag']
+        response = client.get('/api/posts', query_string=parameters,
+                              headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        client.put('/api/posts/2', data=json.dumps({'title': 'New title'}),
+                   content_type='application/json')
+        response = client.get('/api/posts', query_string=parameters,
+                              headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+
+def test_get_posts_response_cache(client, set_posts):
+    parameters = {'sort': 'date', 'direction': 'desc', 'limit': 2}
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        first_response = client.get('/api/posts', query_string=parameters)
+        # The listing is streamed and only cached once it has been read in full
+        assert first_response.json
+        hits = client.get('/api/stats').json['response_cache']['hits']
+        response = client.get('/api/posts', query_string=parameters)
+        assert client.get('/api/stats').json['response_cache']['hits'] == hits + 1
+        assert response.data == first_response.data
+        assert response.headers['X-Next-Cursor'] == first_response.headers['X-Next-Cursor']
+        client.delete('/api/posts/5')
+        response = client.get('/api/posts', query_string=parameters)
+        assert [post['id'] for post in response.json] == [6, 4]
+
+
+def test_bulk_import_and_export(client, set_posts):
+    lines = [json.dumps(post) for post in TEST_POSTS[:3]]
+    lines.insert(1, '{"title": "Missing fields"}')
+    lines.insert(2, 'not json')
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE), \
+            mock.patch("backend.backend_app.BULK_BATCH_SIZE", 2):
+        response = client.post('/api/posts/bulk', data='\n'.join(lines) + '\n',
+                               content_type='application/x-ndjson')
+        assert response.status_code == 200
+        assert response.json['imported'] == 3
+        assert [error['line'] for error in response.json['errors']] == [2, 3]
+        response = client.get('/api/posts/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    exported = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [post['id'] for post in exported] == list(range(1, 10))
+    assert exported[6]['title'] == TEST_POSTS[0]['title']
+
+
+def test_export_can_be_imported_again(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        export = client.get('/api/posts/export').get_data(as_text=True)
+        response = client.post('/api/posts/bulk', data=export,
+                               content_type='application/x-ndjson')
+        assert response.status_code == 200
+        assert response.json == {"imported": 6, "errors": []}
+        exported = [json.loads(line) for line in
+                    client.get('/api/posts/export').get_data(as_text=True).splitlines()]
+    assert [post['id'] for post in exported] == list(range(1, 13))
+    assert [{**post, 'id': None} for post in exported[6:]] == \
+        [{**post, 'id': None} for post in exported[:6]]
+
+
+def call_asgi(path, chunks, disconnect=False):
+    """
+    Send a chunked POST request straight to the ASGI app.
+    :param chunks: the chunks of the body, each in its own message
+    :param disconnect: whether the client goes away instead of sending the last chunk
+    :return: the messages the app sent back
+    """
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+             'path': path, 'query_string': b'', 'root_path': '',
+             'server': ('localhost', 80),
+             'headers': [(b'content-type', b'application/x-ndjson'),
+                         (b'transfer-encoding', b'chunked')]}
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': True} for chunk in chunks]
+    if disconnect:
+        messages.append({'type': 'http.disconnect'})
+    else:
+        messages.append({'type': 'http.request', 'body': b'', 'more_body': False})
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(backend.asgi_app.app(scope, receive, send))
+    return sent
+
+
+def test_asgi_chunked_bulk_import(client, set_posts):
+    chunks = [(json.dumps(post) + '\n').encode('utf-8') for post in TEST_POSTS[:3]]
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        sent = call_asgi('/api/posts/bulk', chunks)
+        assert sent[0]['status'] == 200
+        assert json.loads(b''.join(message.get('body', b'') for message in sent[1:])) == \
+            {"imported": 3, "errors": []}
+        # An upload cut short is not imported at all
+        assert call_asgi('/api/posts/bulk', chunks, disconnect=True) == []
+        assert len(client.get('/api/posts').json) == len(TEST_POSTS) + 3
+
+
+def test_get_posts_streamed_with_capped_limit(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE), \
+            mock.patch("backend.backend_app.MAX_PAGE_LIMIT", 4):
+        response = client.get('/api/posts', query_string={'limit': 100000})
+        assert response.is_streamed
+        assert [post['id'] for post in response.json] == [1, 2, 3, 4]
+        assert response.get_data(as_text=True).startswith('[{"author":"Someone",')
+
+
+def test_error_responses_and_counts(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        not_found = client.get('/api/stats').json['responses'].get('404', 0)
+        response = client.get('/api/no-such-resource')
+        assert response.status_code == 404
+        assert response.json['instructions'] == backend.backend_app.API_INSTRUCTIONS
+        assert response.json['error'] == 'Bad Request'
+        assert response.json['message'].startswith('404 Not Found')
+        assert client.get('/api/stats').json['responses']['404'] == not_found + 1
+        response = client.get('/api/instructions')
+        assert response.status_code == 200
+        assert response.json == backend.backend_app.API_INSTRUCTIONS
+
+
+def test_metrics(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        client.get('/api/posts', query_string={'sort': 'date'}).close()
+        client.get('/api/posts/search', query_string={'title': 'post'}).close()
+        response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    for stage in ('sort', 'index_lookup', 'paginate', 'serialize'):
+        assert f'masterblog_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    assert ('masterblog_request_duration_seconds_count{endpoint="/api/posts",method="GET",'
+            'status="200"}') in text
+
+
+def test_posts_date_range(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts', query_string={'date_from': '2023-01-01'})
+        assert [post['id'] for post in response.json] == [4, 5, 6]
+        parameters = {'sort': 'date', 'direction': 'desc', 'date_from': '2020-04-01',
+                      'date_to': '2024-01-31', 'limit': 3}
+        response = client.get('/api/posts', query_string=parameters)
+        assert [post['id'] for post in response.json] == [6, 4, 3]
+        parameters['cursor'] = response.headers['X-Next-Cursor']
+        response = client.get('/api/posts', query_string=parameters)
+        assert [post['id'] for post in response.json] == [2]
+        response = client.get('/api/posts/search', query_string={
+            'author': 'Somebody', 'date_from': '2023-01-01'})
+        assert [post['id'] for post in response.json] == [4, 6]
+        response = client.get('/api/posts/search', query_string={'date_to': '2020-12-31'})
+        assert [post['id'] for post in response.json] == [1, 2]
+        response = client.get('/api/posts', query_string={'date_from': '2024-13-01'})
+        assert response.status_code == 400
+        # Dates without leading zeros are valid post dates, and valid range bounds
+        response = client.get('/api/posts', query_string={'date_from': '2024-1-1'})
+        assert [post['id'] for post in response.json] == [5, 6]
+
+
+def test_cross_origin_pages_expose_the_cursor(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts', query_string={'limit': 2},
+                              headers={'Origin': 'http://localhost:5001'})
+    assert response.headers['Access-Control-Allow-Origin'] in ('*', 'http://localhost:5001')
+    assert 'X-Next-Cursor' in response.headers['Access-Control-Expose-Headers']
+    assert response.headers['X-Next-Cursor']
+
+
+def test_posts_fields(client, set_posts):
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        response = client.get('/api/posts', query_string={'fields': 'title,date', 'limit': 2})
+        assert response.json == [{'id': 1, 'title': 'First post', 'date': '2020-03-25'},
+                                 {'id': 2, 'title': 'Second post', 'date': '2020-04-20'}]
+        response = client.get('/api/posts/search', query_string={
+            'author': 'Somebody', 'fields': 'author'})
+        assert response.json == [{'id': post_id, 'author': 'Somebody'} for post_id in (2, 4, 6)]
+        response = client.get('/api/posts/search', query_string={
+            'title': 'second', 'rank': 'bm25', 'fields': 'content'})
+        assert set(response.json[0]) == {'id', 'content', 'score'}
+        for fields in ('', 'title,secret'):
+            response = client.get('/api/posts', query_string={'fields': fields})
+            assert response.status_code == 400
+
+
+def test_responses_are_compressed(client, set_posts, monkeypatch):
+    gzip_headers = {'Accept-Encoding': 'gzip'}
+    with mock.patch("backend.backend_app.posts.POSTS_FILE", TEST_POSTS_FILE):
+        plain = client.get('/api/posts', headers=gzip_headers)
+        assert 'Content-Encoding' not in plain.headers
+        assert 'Accept-Encoding' in plain.headers['Vary']
+        monkeypatch.setattr(backend.compression, 'MIN_SIZE', 100)
+        for _ in range(2):
+            response = client.get('/api/posts', query_string={'limit': 5}, headers=gzip_headers)
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert json.loads(gzip.decompress(response.data)) == client.get(
+                '/api/posts', query_string={'limit': 5}).json
+        # The second response came compressed from the response cache
+        compressed = backend.compression.stats()['gzip']['responses']
+        response = client.get('/api/posts', query_string={'limit': 5}, headers=gzip_headers)
+        assert backend.compression.stats()['gzip']['responses'] == compressed
+        etag, weak = response.get_etag()
+        assert weak
+        response = client.get('/api/posts', query_string={'limit': 5},
+                              headers={**gzip_headers, 'If-None-Match': f'W/"{etag}"'})
+        assert response.status_code == 304
+        response = client.get('/api/posts/100', headers=gzip_headers)
+        assert response.status_code == 404
+        assert 'instructions' in json.loads(gzip.decompress(response.data))
+        # The same error again is answered with the body compressed the first time
+        compressed = backend.compression.stats()['gzip']['responses']
+        assert client.get('/api/posts/100', headers=gzip_headers).data == response.data
+        assert backend.compression.stats()['gzip']['responses'] == compressed
+        for _ in range(2):
+            response = client.get('/static/masterblog.json', headers=gzip_headers)
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert json.loads(gzip.decompress(response.data))
+        compressed = backend.compression.stats()['gzip']['responses']
+        client.get('/static/masterblog.json', headers=gzip_headers)
+        assert backend.compression.stats()['gzip']['responses'] == compressed
+        text = client.get('/metrics').get_data(as_text=True)
+        assert 'masterblog_compression_output_bytes_total{encoding="gzip"}' in text
@@ -0,0 +1,32 @@
+import gzip
+from werkzeug.http import parse_accept_header
+import backend.compression as compression
+
+BODY = b'{"title": "First post", "content": "This is the first post."}' * 50
+
+
+def test_negotiate_picks_an_accepted_encoding(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert compression.negotiate(parse_accept_header('gzip, deflate')) == 'gzip'
+    assert compression.negotiate(parse_accept_header('*')) == 'gzip'
+    assert compression.negotiate(parse_accept_header('gzip;q=0, br')) is None
+    assert compression.negotiate(parse_accept_header('')) is None
+
+
+def test_compress_and_compress_stream_are_gzip():
+    assert gzip.decompress(compression.compress(BODY, 'gzip')) == BODY
+    completed = []
+    chunks = [BODY[index:index + 100] for index in range(0, len(BODY), 100)]
+    streamed = b''.join(compression.compress_stream(chunks, 'gzip', completed.append,
+                                                    len(BODY)))
+    assert gzip.decompress(streamed) == BODY
+    assert completed == [streamed]
+    stats = compression.stats()['gzip']
+    assert stats['responses'] >= 2 and 0 < stats['ratio'] < 1
+
+
+def test_compress_stream_does_not_collect_large_bodies():
+    completed = []
+    streamed = b''.join(compression.compress_stream([BODY], 'gzip', completed.append, 10))
+    assert gzip.decompress(streamed) == BODY
+    assert completed == []
@@ -0,0 +1,35 @@
+import pytest
+import backend.json_codec as json_codec
+import backend.backend_app
+
+POSTS = [
+    {"id": 2, "title": "🤯 Second", "author": "Somebody", "date": "2020-04-20", "content": "Ridiculous \\"},
+    {"id": 1, "title": "First post", "author": "Someone", "date": "2020-03-25", "content": "\"quoted\""},
+]
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def codec(request, monkeypatch):
+    """ Run the test with orjson, when installed, and with the json module fallback """
+    if request.param == 'orjson' and json_codec.orjson is None:
+        pytest.skip('orjson is not installed')
+    if request.param == 'json':
+        monkeypatch.setattr(json_codec, 'orjson', None)
+    return request.param
+
+
+def test_round_trip(codec):
+    assert json_codec.loads(json_codec.dumps(POSTS)) == POSTS
+    assert json_codec.loads(json_codec.dumps(POSTS).encode('utf-8')) == POSTS
+    assert json_codec.loads(memoryview(json_codec.dumps(POSTS).encode('utf-8'))) == POSTS
+
+
+def test_sorted_compact_output(codec):
+    assert json_codec.dumps({"b": 1, "a": [1, 2]}, sort_keys=True) == '{"a":[1,2],"b":1}'
+
+
+def test_provider_matches_default_provider(codec):
+    provider = backend.backend_app.app.json
+    assert isinstance(provider, json_codec.JSONProvider)
+    assert provider.loads(provider.dumps(POSTS)) == POSTS
+    assert provider.dumps({"b": 1, "a": 2}).replace(" ", "") == '{"a":2,"b":1}'
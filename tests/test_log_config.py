@@ -0,0 +1,43 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+import textwrap
+from unittest import mock
+from backend.log_config import payload
+
+
+def test_payload_is_truncated():
+    with mock.patch("backend.log_config.PAYLOAD_CHARS", 10):
+        assert str(payload({'a': 1})) == "{'a': 1}"
+        assert str(payload('x' * 25)) == 'xxxxxxxxxx... (25 characters)'
+
+
+def test_payload_is_only_formatted_when_logged():
+    post = mock.MagicMock()
+    wrapped = payload(post)
+    post.__str__.assert_not_called()
+    str(wrapped)
+    post.__str__.assert_called_once()
+
+
+def test_forked_process_writes_its_own_records(tmp_path):
+    log_file = tmp_path / 'blog_backend.log'
+    script = textwrap.dedent('''
+        import logging, os
+        import backend.log_config as log_config
+        log_config.configure_logging()
+        logging.getLogger('parent').warning('Before the fork')
+        pid = os.fork()
+        if pid == 0:
+            logging.getLogger('child').warning('In the child')
+            log_config.stop_logging()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        logging.getLogger('parent').warning('After the fork')
+    ''')
+    subprocess.run([sys.executable, '-c', script], check=True, cwd=Path(__file__).parent.parent,
+                   env={**os.environ, 'MASTERBLOG_LOG_FILE': str(log_file)})
+    lines = log_file.read_text(encoding='utf-8').splitlines()
+    assert [line.split(': ', 1)[1] for line in lines] == \
+        ['Before the fork', 'In the child', 'After the fork']
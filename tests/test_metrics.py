@@ -0,0 +1,30 @@
+from backend.metrics import Registry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    for seconds in (0.0001, 0.003, 0.003, 20):
+        registry.observe('latency_seconds', (('stage', 'save'),), seconds)
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{stage="save",le="0.0001"} 1' in lines
+    assert 'latency_seconds_bucket{stage="save",le="0.0025"} 1' in lines
+    assert 'latency_seconds_bucket{stage="save",le="0.005"} 3' in lines
+    assert 'latency_seconds_bucket{stage="save",le="10.0"} 3' in lines
+    assert 'latency_seconds_bucket{stage="save",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{stage="save"} 4' in lines
+    assert '# TYPE latency_seconds histogram' in lines
+
+
+def test_labels_are_escaped_and_counters_added():
+    registry = Registry()
+    registry.observe('latency_seconds', (('endpoint', 'a"b\\c'),), 1)
+    text = registry.render([('hits_total', 'Hits.', 7)])
+    assert 'latency_seconds_count{endpoint="a\\"b\\\\c"} 1' in text
+    assert '# TYPE hits_total counter\nhits_total 7\n' in text
+
+
+def test_labelled_counters_share_their_description():
+    text = Registry().render([('bytes_total', 'Bytes.', 3, (('encoding', 'gzip'),)),
+                              ('bytes_total', 'Bytes.', 5, (('encoding', 'br'),))])
+    assert text.count('# TYPE bytes_total counter') == 1
+    assert 'bytes_total{encoding="gzip"} 3\nbytes_total{encoding="br"} 5\n' in text
@@ -0,0 +1,50 @@
+import json
+import backend.json_codec as json_codec
+from backend.post_record import Post
+
+POST = {"id": 6, "title": "🤯🤷‍♂️😘👍😴", "author": "Duck", "date": "2024-01-11", "content": "🤯"}
+
+
+def test_post_reads_like_its_dict():
+    post = Post.from_dict(POST)
+    assert post == POST
+    assert POST == post
+    assert post['date'] == '2024-01-11'
+    assert post.get('missing') is None
+    assert list(post) == list(POST)
+    assert {**post, 'score': 1} == {**POST, 'score': 1}
+    assert Post.from_dict(post) is post
+
+
+def test_post_is_compact():
+    post = Post.from_dict(POST)
+    other_post = Post.from_dict({**POST, 'author': ''.join(['Du', 'ck'])})
+    assert post.author is other_post.author
+    assert isinstance(post.date, int)
+    assert not hasattr(post, '__dict__')
+
+
+def test_post_sort_value_orders_dates():
+    dates = ['2024-01-11', '1999-12-31', '2024-1-5', '2024-01-02', 'not a date']
+    posts = [Post.from_dict({**POST, 'date': date}) for date in dates]
+    ordered = sorted(posts, key=lambda post: post.sort_value('date'))
+    # Dates without leading zeros pass validate_date, they sort by their date too
+    assert [post['date'] for post in ordered] == ['not a date', '1999-12-31', '2024-01-02',
+                                                  '2024-1-5', '2024-01-11']
+
+
+def test_post_encodes_as_its_dict(monkeypatch):
+    post = Post.from_dict({**POST, 'tags': ['a']})
+    expected = {**POST, 'tags': ['a']}
+    assert json.loads(json_codec.dumps(post)) == expected
+    monkeypatch.setattr(json_codec, 'orjson', None)
+    assert json.loads(json_codec.dumps([post])) == [expected]
+
+
+def test_post_without_content():
+    post = Post.from_dict(POST).without_content()
+    without_content = {key: value for key, value in POST.items() if key != 'content'}
+    assert post == without_content
+    assert 'content' not in post
+    assert post.to_dict() == without_content
+    assert post.with_content('🤯') == POST
@@ -1,8 +1,11 @@
 import pytest
 import json
 import os.path
+import threading
 from pathlib import Path
 import backend.posts as posts
+import backend.storage as storage
+from backend.search_index import RankingIndex, SearchIndex
 
 TEST_POSTS_WITH_ID = [
     {"id": 1, "title": "First post", "author": "Someone", "date": "2020-03-25", "content": "This is the first post."},
@@ -86,3 +89,313 @@ def test_read_posts_non_json_file(test_files):
 def test_save_post_no_path(test_files):
     with pytest.raises(FileNotFoundError, match="No such file or directory"):
         posts.save_posts(TEST_POSTS_WITH_ID, PATH_DOES_NOT_EXIST)
+
+
+def test_store_write_through(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID[:2], post_file)
+    store = posts.PostStore(post_file, storage_mode='json')
+    assert store.posts() == TEST_POSTS_WITH_ID[:2]
+    new_post = TEST_POSTS_WITH_ID[2].copy()
+    new_post.pop('id')
+    store.add(new_post)
+    assert posts.read_posts(post_file) == TEST_POSTS_WITH_ID[:3]
+
+
+def test_saving_keeps_the_file_mode(tmp_path):
+    post_file = tmp_path / "posts.json"
+    umask = os.umask(0o022)
+    try:
+        posts.save_posts(TEST_POSTS_WITH_ID[:2], post_file)
+        assert post_file.stat().st_mode & 0o777 == 0o644
+        post_file.chmod(0o640)
+        posts.save_posts(TEST_POSTS_WITH_ID[:3], post_file)
+        assert post_file.stat().st_mode & 0o777 == 0o640
+        storage.json_to_snapshot(post_file, tmp_path / "posts.snap")
+        assert (tmp_path / "posts.snap").stat().st_mode & 0o777 == 0o644
+    finally:
+        os.umask(umask)
+
+
+def test_store_picks_up_external_changes(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID[:2], post_file)
+    store = posts.PostStore(post_file, storage_mode='json')
+    assert len(store.posts()) == 2
+    with open(post_file, 'w', encoding='utf-8') as json_file:
+        json.dump(TEST_POSTS_WITH_ID, json_file)
+    assert store.posts() == TEST_POSTS_WITH_ID
+
+
+def test_journal_replay_and_compaction(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID[:2], post_file)
+    store = posts.PostStore(post_file, storage_mode='journal')
+    new_post = TEST_POSTS_WITH_ID[2].copy()
+    new_post.pop('id')
+    assert store.add(new_post)['id'] == 3
+    store.update(1, {'title': 'Changed'})
+    store.delete(2)
+    # The snapshot is untouched, the changes are in the journal
+    assert posts.read_posts(post_file) == TEST_POSTS_WITH_ID[:2]
+    expected = [dict(TEST_POSTS_WITH_ID[0], title='Changed'), TEST_POSTS_WITH_ID[2]]
+    assert posts.PostStore(post_file, storage_mode='journal').posts() == expected
+    store.compact()
+    assert posts.read_posts(post_file) == expected
+    assert not store.storage.journal_file.exists()
+    assert posts.PostStore(post_file, storage_mode='journal').posts() == expected
+
+
+def test_concurrent_writers_do_not_clobber(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts([], post_file)
+    stores = [posts.PostStore(post_file, storage_mode='json'),
+              posts.PostStore(post_file, storage_mode='json')]
+
+    def add_posts(store):
+        for post in TEST_POSTS_WITHOUT_ID * 3:
+            store.add(post.copy())
+
+    threads = [threading.Thread(target=add_posts, args=(store,)) for store in stores * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    saved_ids = [post['id'] for post in posts.read_posts(post_file)]
+    assert sorted(saved_ids) == list(range(1, len(TEST_POSTS_WITHOUT_ID) * 12 + 1))
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == '.tmp'] == []
+
+
+def test_search_index_follows_mutations(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    store = posts.PostStore(post_file, storage_mode='json')
+    assert [post['id'] for post in store.search({'title': 'POST'})] == [1, 2, 3]
+    assert [post['id'] for post in store.search({'content': 'T'})] == [1, 2, 3]
+    assert [post['id'] for post in store.search({'title': '🤷'})] == [6]
+    store.update(2, {'title': 'Renamed'})
+    store.delete(3)
+    assert [post['id'] for post in store.search({'title': 'post'})] == [1]
+    assert [post['id'] for post in store.search({'title': 'renamed'})] == [2]
+    assert len(store.search({'title': 'ird pos'})) == 0
+
+
+def test_sorted_posts_follow_mutations(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    store = posts.PostStore(post_file, storage_mode='json')
+    by_date = sorted(TEST_POSTS_WITH_ID, key=lambda post: post['date'])
+    assert list(store.sorted_posts('date')) == by_date
+    assert store.sorted_posts('date', reverse=True)[1:3] == by_date[::-1][1:3]
+    store.update(1, {'date': '2025-01-01'})
+    store.delete(6)
+    assert [post['id'] for post in store.sorted_posts('date', reverse=True)] == [1, 5, 4, 3, 2]
+    assert store.sorted_posts('date')[-1]['id'] == 1
+
+
+def test_sqlite_storage(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    assert storage.migrate(post_file, tmp_path / "posts.db") == len(TEST_POSTS_WITH_ID)
+    store = posts.PostStore(post_file, storage_mode='sqlite')
+    assert store.posts() == TEST_POSTS_WITH_ID
+    assert [post['id'] for post in store.search({'content': 'SECOND'})] == [2]
+    assert [post['id'] for post in store.search({'content': '\\'})] == [4]
+    # A second connection, like another process, sees the changes
+    other_store = posts.PostStore(post_file, storage_mode='sqlite')
+    store.update(2, {'content': 'Changed'})
+    store.delete(3)
+    assert other_store.get(2)['content'] == 'Changed'
+    assert other_store.get(3) is None
+    assert [post['id'] for post in other_store.search({'content': 'second'})] == []
+    new_post = TEST_POSTS_WITHOUT_ID[0].copy()
+    assert other_store.add(new_post)['id'] == 7
+    assert [post['id'] for post in store.posts()] == [1, 2, 4, 5, 6, 7]
+
+
+@pytest.mark.parametrize('storage_mode', ['json', 'journal', 'sqlite', 'snapshot'])
+def test_worker_processes_agree_on_generation(tmp_path, storage_mode):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    if storage_mode == 'sqlite':
+        storage.migrate(post_file, tmp_path / "posts.db")
+    # Two stores on the same files behave like two worker processes
+    worker, other_worker = (posts.PostStore(post_file, storage_mode=storage_mode),
+                            posts.PostStore(post_file, storage_mode=storage_mode))
+    assert worker.generation() == other_worker.generation()
+    generation = worker.generation()
+    worker.update(1, {'title': 'Changed'})
+    assert other_worker.generation() != generation
+    assert other_worker.generation() == worker.generation()
+    assert other_worker.get(1)['title'] == 'Changed'
+
+
+def test_date_range_follows_mutations(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    store = posts.PostStore(post_file, storage_mode='json')
+    march_2020 = posts.date_range('2020-03-01', '2020-03-31')
+    assert [post['id'] for post in store.sorted_posts('date', date_range=march_2020)] == [1]
+    store.update(4, {'date': '2020-03-02'})
+    store.delete(1)
+    assert [post['id'] for post in store.sorted_posts('date', date_range=march_2020)] == [4]
+    assert [post['id'] for post in store.search({'title': '0'}, date_range=march_2020)] == [4]
+    assert [post['id'] for post in store.sorted_posts(date_range=(None, None))] == [2, 3, 4, 5, 6]
+    with pytest.raises(ValueError):
+        posts.date_range('2020-02-30')
+
+
+@pytest.mark.parametrize('storage_mode', ['json', 'sqlite'])
+def test_date_range_includes_unpadded_dates(tmp_path, storage_mode):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts([{**TEST_POSTS_WITH_ID[0], 'date': '2024-3-5'}] + TEST_POSTS_WITH_ID[1:],
+                     post_file)
+    if storage_mode == 'sqlite':
+        storage.migrate(post_file, tmp_path / "posts.db")
+    store = posts.PostStore(post_file, storage_mode=storage_mode)
+    in_2024 = posts.date_range('2024-01-01')
+    assert [post['id'] for post in store.sorted_posts('date', date_range=in_2024)] == [6, 1, 5]
+    assert [post['id'] for post in store.search({'title': 'post'}, date_range=in_2024)] == [1]
+    assert [post['id'] for post in store.sorted_posts(date_range=posts.date_range(
+        '2024-3-1', '2024-3-31'))] == [1]
+    assert store.get(1)['date'] == '2024-3-5'
+
+
+def test_sqlite_keeps_content_out_of_memory(tmp_path):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    storage.migrate(post_file, tmp_path / "posts.db")
+    store = posts.PostStore(post_file, storage_mode='sqlite')
+    assert store.lazy_content
+    assert all('content' not in post for post in store.sorted_posts())
+    assert store.posts() == TEST_POSTS_WITH_ID
+    assert store.get(2) == TEST_POSTS_WITH_ID[1]
+    assert store.with_content(store.sorted_posts('content')) == \
+        sorted(TEST_POSTS_WITH_ID, key=lambda post: post['content'])
+    assert [post['id'] for post in store.search({'content': 'SECOND'})] == [2]
+    assert store.update(2, {'title': 'Changed'})['content'] == TEST_POSTS_WITH_ID[1]['content']
+    assert store.get(2)['content'] == TEST_POSTS_WITH_ID[1]['content']
+
+
+@pytest.mark.parametrize('storage_mode', ['sqlite', 'snapshot'])
+def test_content_order_reads_only_cut_off_contents(tmp_path, monkeypatch, storage_mode):
+    post_file = tmp_path / "posts.json"
+    shared_start = 'x' * posts.CONTENT_SORT_PREFIX
+    test_posts = TEST_POSTS_WITH_ID + [
+        {**TEST_POSTS_WITH_ID[0], 'id': 7, 'content': shared_start + 'b'},
+        {**TEST_POSTS_WITH_ID[0], 'id': 8, 'content': shared_start + 'a'},
+    ]
+    posts.save_posts(test_posts, post_file)
+    if storage_mode == 'sqlite':
+        storage.migrate(post_file, tmp_path / "posts.db")
+    store = posts.PostStore(post_file, storage_mode=storage_mode)
+    store.posts()
+    read_ids = []
+    contents = store.storage.contents
+    monkeypatch.setattr(store.storage, 'contents',
+                        lambda post_ids: read_ids.append(post_ids) or contents(post_ids))
+
+    def content_order(**kwargs):
+        return [post['id'] for post in store.sorted_posts('content', **kwargs)]
+
+    assert content_order() == [post['id'] for post in
+                               sorted(test_posts, key=lambda post: post['content'])]
+    assert content_order(reverse=True) == [6, 7, 8, 3, 2, 1, 4, 5]
+    # Only the posts whose contents start the same are read, and only once
+    assert [sorted(post_ids) for post_ids in read_ids] == [[7, 8]]
+    assert content_order(date_range=posts.date_range('2020-03-01', '2020-03-31')) == [1, 8, 7]
+    store.update(8, {'content': shared_start + 'c'})
+    store.delete(5)
+    assert content_order() == [4, 1, 2, 3, 7, 8, 6]
+
+
+def test_snapshot_storage(tmp_path):
+    post_file = tmp_path / "posts.json"
+    snapshot_file = tmp_path / "posts.snap"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    assert storage.json_to_snapshot(post_file, snapshot_file) == len(TEST_POSTS_WITH_ID)
+    snapshot = storage.Snapshot(snapshot_file)
+    assert snapshot.read(4) == TEST_POSTS_WITH_ID[3]
+    assert snapshot.read(7) is None
+    store = posts.PostStore(post_file, storage_mode='snapshot')
+    # A single post is read from the snapshot without loading the others
+    assert store.get(6) == TEST_POSTS_WITH_ID[5]
+    assert store.get(7) is None
+    assert store.sorted_posts() and store.lazy_content
+    assert all('content' not in post for post in store.sorted_posts())
+    assert store.posts() == TEST_POSTS_WITH_ID
+    assert [post['id'] for post in store.search({'content': 'SECOND'})] == [2]
+    assert [post['id'] for post in store.search({'content': '\\'})] == [4]
+    store.update(2, {'title': 'Changed'})
+    store.delete(3)
+    other_store = posts.PostStore(post_file, storage_mode='snapshot')
+    assert other_store.get(2)['content'] == TEST_POSTS_WITH_ID[1]['content']
+    assert [post['id'] for post in other_store.posts()] == [1, 2, 4, 5, 6]
+    assert storage.snapshot_to_json(snapshot_file, post_file) == 5
+    assert posts.read_posts(post_file) == other_store.posts()
+
+
+@pytest.mark.parametrize('storage_mode', ['json', 'journal', 'sqlite', 'snapshot'])
+def test_workers_catch_up_without_reindexing(tmp_path, monkeypatch, storage_mode):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    if storage_mode == 'sqlite':
+        storage.migrate(post_file, tmp_path / "posts.db")
+    worker, other_worker = (posts.PostStore(post_file, storage_mode=storage_mode),
+                            posts.PostStore(post_file, storage_mode=storage_mode))
+    assert len(other_worker.posts()) == 6
+    reindexed = []
+    monkeypatch.setattr(other_worker, '_reindex', lambda: reindexed.append(True))
+    worker.update(1, {'content': 'Rewritten by the other worker.'})
+    worker.delete(2)
+    worker.add({"title": "Seventh post", "author": "Else", "date": "2024-11-01",
+                "content": "Brand new words."})
+    # Catching up inside a transaction leaves the changes made by the other worker in place
+    other_worker.update(3, {'title': 'Third post, edited'})
+    assert reindexed == []
+    assert [post['id'] for post in other_worker.sorted_posts()] == [1, 3, 4, 5, 6, 7]
+    assert other_worker.get(1)['content'] == 'Rewritten by the other worker.'
+    assert [post['id'] for post in other_worker.search({'content': 'rewritten'})] == [1]
+    assert list(other_worker.search({'content': 'first post'})) == []
+    assert [post['id'] for post in other_worker.search({'author': 'else'})] == [7]
+    assert other_worker.next_id() == 8
+    assert [post['id'] for _, post in other_worker.rank({'content': 'new words'}, 5)] == [7]
+    assert other_worker.rank({'content': 'first'}, 5) == []
+    assert worker.get(3)['title'] == 'Third post, edited'
+
+
+def test_journal_catch_up_reads_only_new_records(tmp_path, monkeypatch):
+    post_file = tmp_path / "posts.json"
+    posts.save_posts(TEST_POSTS_WITH_ID, post_file)
+    worker, other_worker = (posts.PostStore(post_file, storage_mode='journal'),
+                            posts.PostStore(post_file, storage_mode='journal'))
+    other_worker.posts()
+    worker.update(1, {'title': 'Changed'})
+    assert other_worker.storage.changes() == ([(1, {**TEST_POSTS_WITH_ID[0], 'title': 'Changed'})], {})
+    assert other_worker.storage.changes() == ([], {})
+    # A compaction moves the journal aside, the records appended to it are still found
+    worker.storage.compact()
+    worker.update(2, {'title': 'Changed too'})
+    monkeypatch.setattr(other_worker, '_reindex', lambda: pytest.fail('reindexed'))
+    assert other_worker.get(2)['title'] == 'Changed too'
+    assert other_worker.get(1)['title'] == 'Changed'
+
+
+@pytest.mark.parametrize('gram_fields, shared', [(('title',), False), (('title',), True),
+                                                 (('title', 'content'), False)])
+def test_content_search_matches_substrings(gram_fields, shared):
+    ranking_index = RankingIndex()
+    index = SearchIndex(('title', 'content'), gram_fields,
+                        {'content': ranking_index.postings('content')} if shared else None)
+    posts_by_id = {post['id']: post for post in TEST_POSTS_WITH_ID}
+    for post_id, post in posts_by_id.items():
+        index.add(post_id, post)
+        ranking_index.add(post_id, post)
+    for text in ['first', 'IRST PO', 'is the', 's the s', 'post.', '\\', 'rid', '😘', ' ', 'nowhere']:
+        expected = {post_id for post_id, post in posts_by_id.items()
+                    if text.lower() in post['content'].lower()}
+        assert index.search('content', text, posts_by_id) == expected, text
+    index.remove(1, posts_by_id[1])
+    ranking_index.remove(1, posts_by_id[1])
+    assert index.search('content', 'first', posts_by_id) == set()
+    assert index.search('content', '.', posts_by_id) == {2, 3}
@@ -0,0 +1,45 @@
+from backend.response_cache import ResponseCache
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2, max_bytes=100)
+    cache.put('a', 1, b'aaa')
+    cache.put('b', 1, b'bbb')
+    assert cache.get('a', 1) == (b'aaa', ())
+    cache.put('c', 1, b'ccc')
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_cache_is_bounded_by_bytes():
+    cache = ResponseCache(max_entries=10, max_bytes=10)
+    cache.put('a', 1, b'123456')
+    cache.put('b', 1, b'123456')
+    assert cache.get('a', 1) is None
+    assert cache.stats()['bytes'] == 6
+    cache.put('c', 1, b'12345678901')
+    assert cache.get('c', 1) is None
+
+
+def test_new_generation_invalidates_everything():
+    cache = ResponseCache()
+    cache.put('a', 1, b'aaa', [('X-Next-Cursor', 'abc')])
+    assert cache.get('a', 1) == (b'aaa', (('X-Next-Cursor', 'abc'),))
+    assert cache.get('a', 2) is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_compressed_copies_go_with_their_entry():
+    cache = ResponseCache(max_entries=10, max_bytes=20)
+    cache.put('a', 1, b'123456')
+    cache.put_encoded('a', 1, 'gzip', b'1234')
+    cache.put_encoded('b', 1, 'gzip', b'1234')
+    assert cache.get_encoded('a', 1, 'gzip') == b'1234'
+    assert cache.get_encoded('a', 1, 'br') is None
+    assert cache.get_encoded('b', 1, 'gzip') is None
+    assert cache.stats()['bytes'] == 10
+    cache.put('c', 1, b'12345678901')
+    assert cache.get('a', 1) is None
+    assert cache.stats()['bytes'] == 11
+    assert cache.get_encoded('c', 2, 'gzip') is None
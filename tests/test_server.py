@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import urllib.request
+import pytest
+from backend.server import PooledWSGIServer
+
+
+def test_pooled_server_bounds_the_threads():
+    running = []
+    most_running = []
+    lock = threading.Lock()
+
+    def app(environ, start_response):
+        with lock:
+            running.append(True)
+            most_running.append(len(running))
+        time.sleep(0.1)
+        with lock:
+            running.pop()
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    server = PooledWSGIServer('127.0.0.1', 0, app, threads=2)
+    serving = threading.Thread(target=server.serve_forever)
+    serving.start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    bodies = []
+    clients = [threading.Thread(target=lambda: bodies.append(urllib.request.urlopen(url).read()))
+               for _ in range(6)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    server.shutdown()
+    server.server_close()
+    serving.join()
+    assert bodies == [b'ok'] * 6
+    assert max(most_running) == 2
+
+
+@pytest.mark.skipif(not os.path.exists(f'/proc/{os.getpid()}/task/{os.getpid()}/children'),
+                    reason='needs the children of a process listed in /proc')
+def test_sigterm_stops_the_forked_workers():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    script = textwrap.dedent(f'''
+        import backend.server as server
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'ok']
+
+        server.serve_forked(app, '127.0.0.1', {port}, workers=2, threads=2)
+    ''')
+    parent = subprocess.Popen([sys.executable, '-c', script], cwd=Path(__file__).parent.parent)
+    try:
+        children_file = Path(f'/proc/{parent.pid}/task/{parent.pid}/children')
+        for _ in range(100):
+            children = [int(pid) for pid in children_file.read_text().split()]
+            if len(children) == 2:
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+                    break
+                except OSError:
+                    pass
+            time.sleep(0.05)
+        assert len(children) == 2
+        parent.send_signal(signal.SIGTERM)
+        assert parent.wait(timeout=10) == 0
+        for pid in children:
+            with pytest.raises(ProcessLookupError):
+                os.kill(pid, 0)
+    finally:
+        parent.kill()